@@ -1,21 +1,66 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Depends
-from typing import List, Dict
+from typing import List, Dict, BinaryIO
+import asyncio
 import shutil
 import os
-import json
-from pathlib import Path
 import logging
 
 from app.config import settings
 from app.services.document_processor import DocumentProcessor
 from app.services.backup import BackupService
+from app.services.document_store import DocumentStore
+from app.services.rag import RAGService
+from app.api.qa import semantic_cache
+from app.api.voice import audio_cache
 from app.auth import get_current_admin
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Read uploads in 256 KiB chunks (4x fewer syscalls per MiB than the 64 KiB default)
+COPY_BUF = 256 * 1024
+
+# Max files parsed at once by process_and_index_files
+PROCESS_CONCURRENCY = min(8, os.cpu_count() or 1)
+
 document_processor = DocumentProcessor(settings.upload_dir)
 backup_service = BackupService()
+document_store = DocumentStore(settings.chroma_persist_dir)
+rag_service = RAGService()
+
+def _save(src: BinaryIO, file_path: str) -> None:
+    """
+    Persist an upload's file object to disk (runs in a worker thread).
+    UploadFile is a SpooledTemporaryFile: bodies rolled over to a temp file
+    are copied in-kernel with sendfile(2), small in-memory ones in COPY_BUF chunks.
+    """
+    # A spooled file only has a name (an fd or path) once it is on disk;
+    # asking an in-memory one for fileno() would force it to roll over
+    if getattr(src, "name", None) is not None and hasattr(os, "sendfile"):
+        try:
+            _sendfile(src, file_path)
+            return
+        except OSError:
+            pass
+
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(src, buffer, COPY_BUF)
+
+def _sendfile(src: BinaryIO, file_path: str) -> None:
+    """Copy a disk-backed file object to file_path without a userspace buffer."""
+    src.flush()
+    in_fd = src.fileno()
+    size = os.fstat(in_fd).st_size
+    out_fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    finally:
+        os.close(out_fd)
 
 @router.post("/upload")
 async def upload_files(
@@ -28,16 +73,19 @@ async def upload_files(
     """
     uploaded_files = []
     
-    os.makedirs(settings.upload_dir, exist_ok=True)
-    
-    for file in files:
-        file_path = os.path.join(settings.upload_dir, file.filename)
-        try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            uploaded_files.append(file.filename)
-        except Exception as e:
-            logger.error(f"Error saving file {file.filename}: {e}")
+    # Save all files of the batch concurrently so their writes overlap in the kernel
+    results = await asyncio.gather(
+        *[
+            asyncio.to_thread(_save, file.file, os.path.join(settings.upload_dir, file.filename))
+            for file in files
+        ],
+        return_exceptions=True
+    )
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
+            logger.error("Error saving file %s: %s", file.filename, result)
+            continue
+        uploaded_files.append(file.filename)
             
     # Trigger processing in background
     if background_tasks:
@@ -51,88 +99,77 @@ async def list_files(current_user: str = Depends(get_current_admin)):
     List uploaded files with processing status.
     """
     try:
-        if not os.path.exists(settings.upload_dir):
+        # scandir yields entries with cached stat data: one stat per file
+        # instead of separate getsize/getmtime calls
+        try:
+            with os.scandir(settings.upload_dir) as it:
+                entries = [entry for entry in it if entry.is_file()]
+        except FileNotFoundError:
             return {"files": []}
         
-        files = os.listdir(settings.upload_dir)
         file_list = []
         
         # Load existing documents to check which files have been processed
-        storage_file = Path(settings.chroma_persist_dir) / "documents.json"
         processed_sources = set()
+        try:
+            processed_sources = document_store.sources()
+        except Exception as e:
+            logger.error("Error loading existing documents: %s", e)
         
-        if storage_file.exists():
-            try:
-                with open(storage_file, 'r', encoding='utf-8') as f:
-                    all_documents = json.load(f)
-                    processed_sources = set(doc['source'] for doc in all_documents)
-            except Exception as e:
-                logger.error(f"Error loading existing documents: {e}")
-        
-        for f in files:
-            file_path = os.path.join(settings.upload_dir, f)
+        for entry in entries:
+            st = entry.stat()
             file_info = {
-                "filename": f,
-                "size": os.path.getsize(file_path),
-                "processed": f in processed_sources,
-                "uploaded_at": os.path.getmtime(file_path)
+                "filename": entry.name,
+                "size": st.st_size,
+                "processed": entry.name in processed_sources,
+                "uploaded_at": st.st_mtime
             }
             file_list.append(file_info)
         
         return {"files": file_list}
     except Exception as e:
-        logger.error(f"Error listing files: {e}")
+        logger.error("Error listing files: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 async def process_and_index_files(filenames: List[str]):
     """
     Process uploaded files and update the index.
     """
-    all_documents = []
-    
-    # Load existing documents if any
-    storage_file = Path(settings.chroma_persist_dir) / "documents.json"
-    
-    # Create directory if not exists
-    os.makedirs(settings.chroma_persist_dir, exist_ok=True)
-    
-    if storage_file.exists():
-        try:
-            with open(storage_file, 'r', encoding='utf-8') as f:
-                all_documents = json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading existing documents: {e}")
+    # Process new files concurrently, bounded so a large batch can't exhaust workers
+    sem = asyncio.Semaphore(PROCESS_CONCURRENCY)
+
+    async def _process_one(filename: str) -> List[Dict]:
+        async with sem:
+            return await document_processor.process_file(os.path.join(settings.upload_dir, filename))
+
+    results = await asyncio.gather(*[_process_one(f) for f in filenames], return_exceptions=True)
 
-    # Process new files
     new_docs = []
-    for filename in filenames:
-        file_path = os.path.join(settings.upload_dir, filename)
-        try:
-            docs = await document_processor.process_file(file_path)
-            new_docs.extend(docs)
-            logger.info(f"Processed {filename}: {len(docs)} chunks")
-        except Exception as e:
-            logger.error(f"Error processing {filename}: {e}")
+    for filename, result in zip(filenames, results):
+        if isinstance(result, Exception):
+            logger.error("Error processing %s: %s", filename, result)
+            continue
+        new_docs.extend(result)
+        logger.info("Processed %s: %s chunks", filename, len(result))
             
-    # Remove old documents from the same source to avoid duplicates
-    # (Simple logic: if we re-upload a file, we replace its chunks)
-    processed_sources = set(doc['source'] for doc in new_docs)
-    all_documents = [doc for doc in all_documents if doc.get('source') not in processed_sources]
-    
-    # Add new documents
-    all_documents.extend(new_docs)
+    # Append new chunks; re-uploaded sources replace their earlier chunks
+    try:
+        document_store.append(new_docs)
+        logger.info("Saved %s documents to %s", len(new_docs), document_store.log_file)
+    except Exception as e:
+        logger.error("Error saving documents: %s", e)
+        return
     
-    # Save updated documents
+    # Make the new chunks searchable now; only they are tokenized and embedded
     try:
-        with open(storage_file, 'w', encoding='utf-8') as f:
-            json.dump(all_documents, f, ensure_ascii=False, indent=2)
-        logger.info(f"Saved {len(all_documents)} documents to {storage_file}")
-        
-        # The RAGService will automatically pick up the new documents
-        # when it's instantiated again for new requests
-        
+        await asyncio.to_thread(rag_service.add_documents, new_docs)
     except Exception as e:
-        logger.error(f"Error saving documents: {e}")
+        logger.error("Error indexing documents: %s", e)
+        return
+    
+    # Answers cached before the upload no longer match the index
+    semantic_cache.clear()
+    audio_cache.clear()
 
 # ==========================================
 # Backup Endpoints
@@ -1,5 +1,6 @@
 
 from datetime import timedelta
+import hmac
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
@@ -8,10 +9,13 @@ from app.auth import Token, create_access_token, verify_password
 
 router = APIRouter()
 
+# Encoded once so each login only pays for the constant-time compare
+_ADMIN_USERNAME_BYTES = settings.admin_username.encode("utf-8")
+
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     # Verify username
-    if form_data.username != settings.admin_username:
+    if not hmac.compare_digest(form_data.username.encode("utf-8"), _ADMIN_USERNAME_BYTES):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
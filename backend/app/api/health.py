@@ -1,51 +1,64 @@
 from fastapi import APIRouter
+import asyncio
 import logging
+import time
+
+# Import providers once at module load instead of on every probe
+try:
+    from gtts import gTTS
+except Exception:
+    gTTS = None
+
+try:
+    import pyttsx3
+except Exception:
+    pyttsx3 = None
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Liveness probes hit this every few seconds; reuse the last result for a while
+TTS_HEALTH_TTL = 30.0
+_tts_cache = {"t": 0.0, "val": None}
+
 @router.get("/tts")
 async def tts_health_check():
     """Check which TTS providers are working"""
-    gtts_available = False
-    pyttsx3_available = False
-    
-    
+    now = time.monotonic()
+    if _tts_cache["val"] and now - _tts_cache["t"] < TTS_HEALTH_TTL:
+        return _tts_cache["val"]
+
     def check_providers():
         gtts_ok = False
-        pyttsx3_ok = False
         
         # Test gTTS
         try:
-            from gtts import gTTS
             gTTS(text="test", lang='en')
             gtts_ok = True
         except:
             gtts_ok = False
             
         # Test pyttsx3
-        try:
-            import pyttsx3
-            # Just check import for health check to avoid COM overhead/hanging
-            # engine = pyttsx3.init() 
-            pyttsx3_ok = True
-        except:
-            pyttsx3_ok = False
+        # Just check import for health check to avoid COM overhead/hanging
+        # engine = pyttsx3.init() 
+        pyttsx3_ok = pyttsx3 is not None
             
         return gtts_ok, pyttsx3_ok
 
-    import asyncio
     gtts_available, pyttsx3_available = await asyncio.to_thread(check_providers)
     
     active_provider = "pyttsx3" if pyttsx3_available and not gtts_available else ("gtts" if gtts_available else "none")
     if gtts_available and pyttsx3_available:
         active_provider = "gtts (with fallback)"
 
-    logger.info(f"TTS Health: gTTS={gtts_available}, pyttsx3={pyttsx3_available}, active={active_provider}")
+    logger.info("TTS Health: gTTS=%s, pyttsx3=%s, active=%s", gtts_available, pyttsx3_available, active_provider)
     
-    return {
+    result = {
         "gtts_available": gtts_available,
         "pyttsx3_available": pyttsx3_available,
         "active_provider": active_provider,
         "status": "healthy" if (gtts_available or pyttsx3_available) else "degraded"
     }
+    _tts_cache["t"] = time.monotonic()
+    _tts_cache["val"] = result
+    return result
@@ -1,10 +1,54 @@
 
 from fastapi import APIRouter, HTTPException
 from pathlib import Path
-import json
+from typing import List, Dict, Optional
+import os
+
+from app import json_utils
 
 router = APIRouter()
 LOG_DIR = Path("logs")
+TAIL_BLOCK = 64 * 1024
+
+# Last parsed tail, keyed by (st_size, st_mtime_ns, lines, level).
+# Any write to the log changes the key, so polling dashboards hit this until new lines land.
+_tail_cache: Dict[tuple, List[Dict]] = {}
+
+def _tail(path: Path, n: int, level: Optional[str] = None) -> List[Dict]:
+    """
+    Return the last n JSON log records (newest first), optionally filtered by level.
+    Reads the file backwards in 64 KiB blocks so memory stays bounded by the block size.
+    """
+    results = []
+    needle = level.encode() if level else None
+
+    def collect(line: bytes) -> bool:
+        # Cheap byte test before paying for a JSON decode
+        if not line or (needle and needle not in line):
+            return False
+        try:
+            log_obj = json_utils.loads(line)
+        except json_utils.JSONDecodeError:
+            return False
+        if level and log_obj.get("level") != level:
+            return False
+        results.append(log_obj)
+        return len(results) >= n
+
+    with open(path, "rb") as f:
+        pos = os.fstat(f.fileno()).st_size
+        carry = b""
+        while pos > 0:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            pieces = (f.read(step) + carry).split(b"\n")
+            # The first piece may be the tail of a line that starts in an earlier block
+            carry = pieces.pop(0) if pos > 0 else b""
+            for line in reversed(pieces):
+                if collect(line):
+                    return results
+    return results
 
 @router.get("/logs")
 async def get_logs(lines: int = 50, level: str = None):
@@ -14,28 +58,20 @@ async def get_logs(lines: int = 50, level: str = None):
     level: Filter by log level (ERROR, INFO, etc.)
     """
     log_file = LOG_DIR / "app.log"
-    if not log_file.exists():
-         return {"logs": []}
-         
-    results = []
     try:
-        # Read file in reverse roughly or just read all and tail
-        # For simplicity, reading all and tailing (file rotated at 10MB)
-        with open(log_file, "r", encoding="utf-8") as f:
-            all_lines = f.readlines()
-            
-        # Filter and parse
-        for line in reversed(all_lines):
-            try:
-                log_obj = json.loads(line)
-                if level and log_obj.get("level") != level:
-                    continue
-                results.append(log_obj)
-                if len(results) >= lines:
-                    break
-            except json.JSONDecodeError:
-                continue
-                
+        st = os.stat(log_file)
+    except FileNotFoundError:
+        return {"logs": []}
+
+    key = (st.st_size, st.st_mtime_ns, lines, level)
+    cached = _tail_cache.get(key)
+    if cached is not None:
+        return {"logs": cached}
+
+    try:
+        results = _tail(log_file, lines, level)
+        _tail_cache.clear()
+        _tail_cache[key] = results
         return {"logs": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
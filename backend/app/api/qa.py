@@ -1,18 +1,26 @@
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Request
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Request, Depends
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import asyncio
-import json
+from collections import OrderedDict
+from contextlib import aclosing
+import functools
+import hashlib
 import logging
 import os
 from pathlib import Path
+import secrets
 import time
+from uuid import uuid4
 
-from app.services.rag import RAGService
+from app.services.rag import RAGService, SemanticResponseCache
 from app.config import settings
 from app.services.tts import TTSService
 from app.services.stt import STTService
 from app.limiter import limiter
+from app.auth import get_current_admin
+from app import json_utils
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -20,9 +28,23 @@ router = APIRouter()
 # Initialize RAG service
 rag_service = RAGService()
 
+# College details for the system prompt; wired into the RAG service once at startup
+college_config = {
+    'name': settings.college_name,
+    'admissions_phone': settings.admissions_phone,
+    'support_email': settings.support_email
+}
+
+# Approximate cache for paraphrased queries, reusing the retriever's embedding model
+semantic_cache = SemanticResponseCache(rag_service.hybrid_retriever.vector_store.embed_query)
+
 # Initialize TTS and STT services
 tts_service = TTSService()
-stt_service = STTService()
+
+@functools.cache
+def get_stt_service() -> STTService:
+    """STT is only used by /ws transcribe requests, so build it on first use"""
+    return STTService()
 
 class QueryRequest(BaseModel):
     message: str
@@ -43,12 +65,12 @@ async def query_endpoint(request: Request, query_data: QueryRequest):
     """Handle text-based queries with response caching"""
     start_time = time.time()
     session_id = getattr(request.state, 'session_id', 'default')
-    logger.info(f"[{session_id}] Query received: '{query_data.message[:60]}...'")
+    logger.info("[%s] Query received: '%.60s...'", session_id, query_data.message)
     try:
         # Check cache first for instant response
         cached_answer = rag_service.response_cache.get(query_data.message)
         if cached_answer:
-            logger.info(f"Returning cached response for: {query_data.message[:50]}...")
+            logger.info("Returning cached response for: %.50s...", query_data.message)
             session_id = getattr(request.state, 'session_id', 'default')
             return QueryResponse(
                 answer=cached_answer,
@@ -56,18 +78,17 @@ async def query_endpoint(request: Request, query_data: QueryRequest):
                 session_id=session_id
             )
         
-        # Set clients for RAG service if not already set
-        college_config = {
-            'name': settings.college_name,
-            'admissions_phone': settings.admissions_phone,
-            'support_email': settings.support_email
-        }
-        rag_service.set_clients(settings.groq_client, college_config)
-        
-
+        # Then the semantic cache, so paraphrases of earlier questions skip RAG + LLM
+        cached_answer, query_vector = await asyncio.to_thread(semantic_cache.lookup, query_data.message)
+        if cached_answer:
+            return QueryResponse(
+                answer=cached_answer,
+                sources=[],
+                session_id=query_data.session_id or "default"
+            )
         
         # Process the query
-        logger.info(f"[{session_id}] Processing query via RAGService...")
+        logger.info("[%s] Processing query via RAGService...", session_id)
         async for result in rag_service.query_stream(query_data.message, query_data.session_id):
             if result["type"] == "answer":
                 # Return the generated answer
@@ -75,20 +96,20 @@ async def query_endpoint(request: Request, query_data: QueryRequest):
                 sources = [doc["document"] for doc in result.get("documents", [])[:3]]  # Top 3
                 session_id = query_data.session_id or "default"
                 
-                # Cache the response for future queries
-                # rag_service.response_cache.set(query_data.message, answer) <-- Removed (handled in RAGService)
-                
-
+                # Exact-match caching is handled in RAGService; only answers the
+                # LLM generated for no one in particular go into the semantic cache
+                if result.get("cacheable"):
+                    semantic_cache.add(query_data.message, answer, query_vector)
                 
                 elapsed = time.time() - start_time
-                logger.info(f"[{session_id}] Query processed in {elapsed:.2f}s")
+                logger.info("[%s] Query processed in %.2fs", session_id, elapsed)
                 return QueryResponse(
                     answer=answer,
                     sources=sources,
                     session_id=session_id
                 )
             elif result["type"] == "error":
-                logger.error(f"Error in query processing: {result['message']}")
+                logger.error("Error in query processing: %s", result['message'])
                 return QueryResponse(
                     answer="I'm having trouble processing your request. Please try again.",
                     sources=[],
@@ -102,30 +123,100 @@ async def query_endpoint(request: Request, query_data: QueryRequest):
             session_id=query_data.session_id or "default"
         )
     except Exception as e:
-        logger.error(f"Error processing query: {e}")
+        logger.error("Error processing query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+# Recently served TTS files known to exist on disk, so repeats skip the stat()
+TTS_FILE_CACHE_SIZE = 200
+_tts_files: "OrderedDict[str, None]" = OrderedDict()
+
+def _remember_tts_file(filename: str) -> None:
+    _tts_files[filename] = None
+    _tts_files.move_to_end(filename)
+    if len(_tts_files) > TTS_FILE_CACHE_SIZE:
+        _tts_files.popitem(last=False)
+
+def _tts_response(request: Request, filename: str, filepath: str, session_id: str):
+    """
+    Clients that accept audio/mpeg get the audio in this response, saving the
+    second round trip to /audio; others get the JSON URL as before.
+    """
+    if "audio/mpeg" in request.headers.get("accept", ""):
+        return FileResponse(filepath, media_type="audio/mpeg", headers={"X-Session-Id": session_id})
+    return {"audio_url": f"/audio/{filename}", "session_id": session_id}
+
+# Renders in progress, by filename, so concurrent requests for the same text
+# (e.g. the /voice pre-render and a play click) share one synthesis
+_tts_inflight: Dict[str, asyncio.Task] = {}
+
+def tts_filename(text: str) -> str:
+    """Name of the MP3 that holds the speech for text."""
+    # Name the file by a stable digest of the text (hash() is salted per process),
+    # so repeat phrases are served from disk across sessions, workers and restarts.
+    # Whitespace doesn't change the audio, so it doesn't change the key either
+    normalized = " ".join(text.split())
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+    return f"tts_{digest}.mp3"
+
+def cached_tts_url(text: str) -> Optional[str]:
+    """/audio URL of the already rendered speech for text, or None."""
+    filename = tts_filename(text)
+    if filename in _tts_files or os.path.exists(os.path.join(settings.temp_audio_dir, filename)):
+        return f"/audio/{filename}"
+    return None
+
+async def synthesize_tts_file(text: str) -> Tuple[str, str]:
+    """
+    Render text to an MP3 under temp_audio_dir, reusing an existing file for
+    the same text. Returns (filename, filepath).
+    """
+    filename = tts_filename(text)
+    filepath = os.path.join(settings.temp_audio_dir, filename)
+    
+    if filename in _tts_files or os.path.exists(filepath):
+        _remember_tts_file(filename)
+        return filename, filepath
+    
+    task = _tts_inflight.get(filename)
+    if task is None:
+        task = asyncio.create_task(_render_tts_file(text, filename, filepath))
+        _tts_inflight[filename] = task
+        task.add_done_callback(lambda t: _tts_render_done(filename, t))
+    # shield: one waiter going away (client disconnect) doesn't cancel the others
+    await asyncio.shield(task)
+    return filename, filepath
+
+def _tts_render_done(filename: str, task: asyncio.Task) -> None:
+    _tts_inflight.pop(filename, None)
+    if not task.cancelled() and task.exception() is not None:
+        # Marks the error retrieved even if every waiter has gone away
+        logger.debug("TTS render failed for %s: %s", filename, task.exception())
+
+async def _render_tts_file(text: str, filename: str, filepath: str) -> None:
+    # Write audio chunks as they are synthesized, then publish atomically so a
+    # concurrent request never serves a partially written file
+    tmp_path = f"{filepath}.{uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            async for chunk in tts_service.text_to_speech_stream(text):
+                f.write(chunk)
+        os.replace(tmp_path, filepath)
+        _remember_tts_file(filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 @router.post("/tts")
 @limiter.limit("20/minute")
 async def tts_endpoint(tts_data: TTSRequest, request: Request):
     """Convert text to speech"""
     try:
-        # Use default voice if none provided
-        audio_content = await tts_service.text_to_speech(tts_data.text)
-        
-        # Save to temporary file and return path
         session_id = tts_data.session_id or "default"
-        filename = f"tts_{session_id}_{hash(tts_data.text)}.mp3"
-        filepath = os.path.join(settings.temp_audio_dir, filename)
-        
-        os.makedirs(settings.temp_audio_dir, exist_ok=True)
-        
-        with open(filepath, "wb") as f:
-            f.write(audio_content)
-        
-        return {"audio_url": f"/audio/{filename}", "session_id": session_id}
+        filename, filepath = await synthesize_tts_file(tts_data.text)
+        return _tts_response(request, filename, filepath, session_id)
     except Exception as e:
-        logger.error(f"Error in TTS: {e}")
+        logger.error("Error in TTS: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/health")
@@ -150,19 +241,22 @@ class FeedbackResponse(BaseModel):
     status: str
     saved: bool
 
+FEEDBACK_FILE = os.path.join(settings.chroma_persist_dir, 'feedback.jsonl')
+LEGACY_FEEDBACK_FILE = os.path.join(settings.chroma_persist_dir, 'feedback.json')
+
+_feedback_lock = asyncio.Lock()
+# Opened on first use and kept open; unbuffered, so each entry is one write()
+_feedback_fh = None
+
+def _append_feedback(line: bytes) -> None:
+    global _feedback_fh
+    if _feedback_fh is None:
+        _feedback_fh = open(FEEDBACK_FILE, 'ab', buffering=0)
+    _feedback_fh.write(line)
+
 @router.post("/feedback", response_model=FeedbackResponse)
 async def submit_feedback(feedback: FeedbackRequest):
     """Collect user feedback for continuous improvement."""
-    storage_file = os.path.join(settings.chroma_persist_dir, 'feedback.json')
-    os.makedirs(os.path.dirname(storage_file), exist_ok=True)
-    data = []
-    try:
-        if os.path.exists(storage_file):
-            with open(storage_file, 'r', encoding='utf-8') as f:
-                data = json.load(f) or []
-    except Exception:
-        data = []
-
     entry = {
         'message': feedback.message,
         'answer': feedback.answer,
@@ -170,13 +264,32 @@ async def submit_feedback(feedback: FeedbackRequest):
         'comment': feedback.comment or "",
     }
     try:
-        data.append(entry)
-        with open(storage_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # Append one line per entry instead of re-reading and rewriting the whole history.
+        # The write runs off the event loop; the lock keeps concurrent lines from interleaving.
+        async with _feedback_lock:
+            await asyncio.to_thread(_append_feedback, json_utils.dumps(entry) + b"\n")
         return FeedbackResponse(status='ok', saved=True)
     except Exception:
         return FeedbackResponse(status='error', saved=False)
 
+@router.get("/feedback/export")
+async def export_feedback(current_user: str = Depends(get_current_admin)):
+    """Stream all stored feedback as JSON Lines."""
+    def iter_lines():
+        try:
+            with open(LEGACY_FEEDBACK_FILE, 'rb') as f:
+                for entry in json_utils.loads(f.read()) or []:
+                    yield json_utils.dumps(entry) + b"\n"
+        except FileNotFoundError:
+            pass
+        try:
+            with open(FEEDBACK_FILE, 'rb') as f:
+                yield from f
+        except FileNotFoundError:
+            pass
+
+    return StreamingResponse(iter_lines(), media_type="application/x-ndjson")
+
 # WebSocket for voice interactions
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -185,73 +298,68 @@ async def websocket_endpoint(websocket: WebSocket):
     # Check if Groq client is available
     if not settings.groq_client:
         error_msg = f"I'm having trouble connecting to the AI service. Please make sure your GROQ_API_KEY is set in the environment."
-        await websocket.send_text(json.dumps({
+        await json_utils.send_json(websocket, {
             "type": "error",
             "message": error_msg
-        }))
+        })
         await websocket.close()
         return
     
-    # Set clients for RAG service
-    college_config = {
-        'name': settings.college_name,
-        'admissions_phone': settings.admissions_phone,
-        'support_email': settings.support_email
-    }
-    rag_service.set_clients(settings.groq_client, college_config)
-    
     # Send ready message with session ID
-    session_id = f"session_{hash(websocket) % 10000}"
-    await websocket.send_text(json.dumps({
+    session_id = f"session_{secrets.token_hex(8)}"
+    await json_utils.send_json(websocket, {
         "type": "ready",
         "session_id": session_id
-    }))
+    })
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                # Audio sent as a binary frame: a third smaller than base64 in
+                # JSON, and nothing to decode
+                message_data = {"type": "transcribe", "audio": message["bytes"]}
+            else:
+                message_data = json_utils.loads(message["text"])
             
             if message_data.get("type") == "transcribe":
                 audio_data = message_data.get("audio")
                 # Process audio through STT
-                transcript = await stt_service.transcribe_audio(audio_data)
+                transcript = await get_stt_service().transcribe_audio(audio_data)
                 
                 if transcript:
-                    # Send transcript back
-                    await websocket.send_text(json.dumps({
-                        "type": "transcript",
-                        "text": transcript
-                    }))
+                    # No separate transcript echo: the answer (or error) frame
+                    # carries it, so each turn costs a single WebSocket frame
                     
-                    # Process query using RAG
-                    async for result in rag_service.query_stream(transcript, session_id):
-                        if result["type"] == "answer" and result.get("answer"):
-                            answer = result["answer"]
-                            
-                            # Convert to speech
-                            audio_content = await tts_service.text_to_speech(answer)
-                            
-                            # Send answer to client
-                            await websocket.send_text(json.dumps({
-                                "type": "answer",
-                                "text": answer,
-                                "session_id": session_id
-                            }))
-                            
-                            break
-                        elif result["type"] == "error":
-                            await websocket.send_text(json.dumps({
-                                "type": "error",
-                                "message": result["message"]
-                            }))
-                        elif result["type"] == "error":
-                            await websocket.send_text(json.dumps({
-                                "type": "error",
-                                "message": result["message"]
-                            }))
+                    # Process query using RAG; aclosing() shuts the generator down as
+                    # soon as we stop consuming it instead of leaving it to the GC
+                    async with aclosing(rag_service.query_stream(transcript, session_id)) as results:
+                        async for result in results:
+                            if result["type"] == "answer" and result.get("answer"):
+                                answer = result["answer"]
+                                
+                                # Send answer to client
+                                await json_utils.send_json(websocket, {
+                                    "type": "answer",
+                                    "text": answer,
+                                    "session_id": session_id,
+                                    "transcript": transcript
+                                })
+                                
+                                break
+                            elif result["type"] == "error":
+                                await json_utils.send_json(websocket, {
+                                    "type": "error",
+                                    "message": result["message"],
+                                    "transcript": transcript
+                                })
+                                break
     except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnected for session {session_id}")
+        logger.info("WebSocket disconnected for session %s", session_id)
     except Exception as e:
-        logger.error(f"WebSocket error: {e}")
-        await websocket.close()
\ No newline at end of file
+        logger.error("WebSocket error: %s", e)
+        await websocket.close()
+    finally:
+        rag_service.end_session(session_id)
\ No newline at end of file
@@ -1,213 +1,382 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict
+from typing import Optional, Tuple
 import asyncio
-import json
+import hashlib
 import logging
 import os
 import time
 from uuid import uuid4
-from collections import defaultdict
+from collections import OrderedDict
+from contextlib import aclosing
 
 from app.services.rag import RAGService
 from app.config import settings
-from app.services.tts import TTSService
-from app.services.stt import STTService
+from app.api.qa import synthesize_tts_file, cached_tts_url, semantic_cache
+from app import json_utils
 from app.services.conversation_memory import ConversationMemory
 
+# MessagePack is optional; clients opt in by offering the "msgpack" subprotocol
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# msgspec is optional too; with it outgoing msgpack frames are encoded straight
+# from typed structs instead of building a dict per frame
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if msgspec is not None:
+    class ReadyMsg(msgspec.Struct, tag="ready", tag_field="type", frozen=True):
+        session_id: str
+
+    class AnswerMsg(msgspec.Struct, tag="answer", tag_field="type", frozen=True, omit_defaults=True):
+        text: str
+        session_id: str
+        transcript: str
+        audio_url: Optional[str] = None
+
+    class AnswerChunkMsg(msgspec.Struct, tag="answer_chunk", tag_field="type", frozen=True):
+        text: str
+
+    class AudioMsg(msgspec.Struct, tag="audio", tag_field="type", frozen=True):
+        text: str
+        audio_url: str
+
+    _msgpack_encoder = msgspec.msgpack.Encoder()
+
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+# The ready frame differs per connection only by session id, which is hex and
+# needs no escaping, so JSON clients get it from a template instead of an encode
+READY_FRAME_TEMPLATE = '{"type":"ready","session_id":"%s"}'
+
+# Streamed answer pieces only vary in their text
+ANSWER_CHUNK_HEAD = b'{"type":"answer_chunk","text":'
+
+# Interrupt frames carry nothing but their type, so they are recognised from
+# their leading bytes and never decoded. JSON as sent by JSON.stringify; the
+# msgpack tag follows the one-byte map header
+INTERRUPT_JSON_PREFIX = '{"type":"interrupt"'
+INTERRUPT_MSGPACK_TAG = b'\xa4type\xa9interrupt'
+
 # Initialize services
 rag_service = RAGService()
-tts_service = TTSService()
-stt_service = STTService()
-conversation_memory = ConversationMemory()
+# Share the RAG service's memory: a second instance would keep its own copy of
+# the sessions and overwrite the other's writes to conversation_memory.json
+conversation_memory: ConversationMemory = rag_service.conversation_memory
+
+# Answers are user-agnostic, so cached responses are shared across sessions,
+# keyed on a digest of the normalized transcript. Bounded LRU with a TTL so
+# the process doesn't grow forever and stale answers age out. The audio for
+# each answer lives in the TTS file cache (served from /audio), so only the
+# text is kept here, along with its JSON encoding so a hit never re-encodes it
+AUDIO_CACHE_SIZE = 1024
+AUDIO_CACHE_TTL = 3600  # seconds
+audio_cache: "OrderedDict[bytes, Tuple[float, str, bytes]]" = OrderedDict()
+
+def _cache_key(transcript: str) -> bytes:
+    normalized = " ".join(transcript.lower().split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+def _cache_get(key: bytes) -> Optional[Tuple[str, bytes]]:
+    """Return (text, JSON-encoded text) for a live entry, or None."""
+    entry = audio_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, text, encoded_text = entry
+    if time.monotonic() - stored_at > AUDIO_CACHE_TTL:
+        del audio_cache[key]
+        return None
+    audio_cache.move_to_end(key)
+    return text, encoded_text
+
+def _cache_put(key: bytes, text: str) -> bytes:
+    """Cache an answer and return its JSON encoding."""
+    encoded_text = json_utils.dumps(text)
+    audio_cache[key] = (time.monotonic(), text, encoded_text)
+    audio_cache.move_to_end(key)
+    if len(audio_cache) > AUDIO_CACHE_SIZE:
+        audio_cache.popitem(last=False)
+    return encoded_text
 
-# Audio cache for session-based responses
-audio_cache: Dict[str, bytes] = {}
+# Answers waiting to be pre-rendered to speech, per connection. When full, new
+# answers are skipped rather than holding up the receive loop
+TTS_QUEUE_SIZE = 3
+
+async def _prerender_tts(conn: "_VoiceConnection") -> None:
+    """
+    Render queued answers to the TTS file cache in order and tell the client
+    where each one can be fetched. The audio itself goes over HTTP from the
+    /audio static mount, never through the WebSocket.
+    """
+    session_id = conn.session_id
+    queue = conn.tts_queue
+    while True:
+        text = await queue.get()
+        try:
+            tts_start = time.time()
+            filename, _ = await synthesize_tts_file(text)
+            logger.info("[%s] TTS ready in %.2fs (%s)", session_id, time.time() - tts_start, filename)
+            await conn.send_audio(text, f"/audio/{filename}")
+        except Exception as e:
+            logger.error("[%s] TTS error: %s", session_id, e)
+        finally:
+            queue.task_done()
+
+class _VoiceConnection:
+    """Per-connection state shared by the message handlers."""
+    
+    def __init__(self, websocket: WebSocket, session_id: str, use_msgpack: bool):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.use_msgpack = use_msgpack
+        # JSON answer frames are assembled from pre-encoded pieces: the fixed head
+        # is encoded once per connection and cached answer text never re-encoded
+        self.answer_head = b'{"type":"answer","session_id":' + json_utils.dumps(session_id) + b',"text":'
+        # Speech is rendered by a background task so answers are sent without waiting on TTS
+        self.tts_queue: asyncio.Queue = asyncio.Queue(maxsize=TTS_QUEUE_SIZE)
+        self.tts_worker: Optional[asyncio.Task] = None
+    
+    async def send(self, payload: dict) -> None:
+        if self.use_msgpack:
+            await self.websocket.send_bytes(msgpack.packb(payload, use_bin_type=True))
+        else:
+            await json_utils.send_json(self.websocket, payload)
+    
+    async def send_ready(self) -> None:
+        if not self.use_msgpack:
+            await self.websocket.send_text(READY_FRAME_TEMPLATE % self.session_id)
+        elif msgspec is not None:
+            await self.websocket.send_bytes(_msgpack_encoder.encode(ReadyMsg(session_id=self.session_id)))
+        else:
+            await self.send({"type": "ready", "session_id": self.session_id})
+    
+    async def send_chunk(self, text: str) -> None:
+        """Send one streamed piece of an answer that is still being generated."""
+        if not self.use_msgpack:
+            await self.websocket.send_text((ANSWER_CHUNK_HEAD + json_utils.dumps(text) + b'}').decode("utf-8"))
+        elif msgspec is not None:
+            await self.websocket.send_bytes(_msgpack_encoder.encode(AnswerChunkMsg(text=text)))
+        else:
+            await self.send({"type": "answer_chunk", "text": text})
+    
+    async def send_audio(self, text: str, audio_url: str) -> None:
+        if self.use_msgpack and msgspec is not None:
+            await self.websocket.send_bytes(_msgpack_encoder.encode(AudioMsg(text=text, audio_url=audio_url)))
+        else:
+            await self.send({"type": "audio", "text": text, "audio_url": audio_url})
+    
+    async def send_answer(self, text: str, transcript: str, encoded_text: Optional[bytes] = None,
+                          audio_url: Optional[str] = None) -> None:
+        """Send an answer frame; audio_url is included when its speech is already rendered."""
+        if self.use_msgpack and msgspec is not None:
+            await self.websocket.send_bytes(_msgpack_encoder.encode(AnswerMsg(
+                text=text,
+                session_id=self.session_id,
+                transcript=transcript,
+                audio_url=audio_url
+            )))
+            return
+        if self.use_msgpack:
+            payload = {
+                "type": "answer",
+                "text": text,
+                "session_id": self.session_id,
+                "transcript": transcript
+            }
+            if audio_url is not None:
+                payload["audio_url"] = audio_url
+            await self.send(payload)
+            return
+        if encoded_text is None:
+            encoded_text = json_utils.dumps(text)
+        frame = self.answer_head + encoded_text + b',"transcript":' + json_utils.dumps(transcript)
+        if audio_url is not None:
+            # URLs are /audio/tts_<hex>.mp3 and need no escaping
+            frame += b',"audio_url":"' + audio_url.encode("ascii") + b'"'
+        await self.websocket.send_text((frame + b'}').decode("utf-8"))
+
+async def _handle_transcript(conn: _VoiceConnection, message_data: dict) -> None:
+    session_id = conn.session_id
+    transcript = message_data.get("text", "")
+    
+    if not transcript.strip():
+        return
+        
+    logger.info("[%s] Processing transcript: '%s'", session_id, transcript)
+    
+    # Add to conversation memory
+    conversation_memory.add_interaction(
+        session_id, 
+        user_message=transcript, 
+        bot_response=""
+    )
+    
+    # Check if this query has already been answered
+    cache_key = _cache_key(transcript)
+    
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        logger.info("[%s] Sending cached voice response", session_id)
+        # Send cached response; its audio is normally already in the TTS file cache
+        cached_text, encoded_text = cached
+        await conn.send_answer(cached_text, transcript, encoded_text, cached_tts_url(cached_text))
+        return
+    
+    # Then for a paraphrase of an answered question. The cache is
+    # shared with /qa/query; embedding runs off the event loop
+    cached_text, query_vector = await asyncio.to_thread(semantic_cache.lookup, transcript)
+    if cached_text is not None:
+        logger.info("[%s] Sending semantically cached voice response", session_id)
+        encoded_text = _cache_put(cache_key, cached_text)
+        await conn.send_answer(cached_text, transcript, encoded_text, cached_tts_url(cached_text))
+        return
+    
+    # No separate transcript echo: the answer frame carries the
+    # transcript, so each turn costs a single WebSocket frame
+    
+    # Process the query using RAG
+    process_start = time.time()
+    try:
+        # Check if Groq client is available
+        if not settings.groq_client:
+            error_msg = f"I'm having trouble connecting to the AI service. Please make sure your GROQ_API_KEY is set in the environment."
+            log_msg = "GROQ_API_KEY not set"
+            logger.error("[%s] %s", session_id, log_msg)
+            await conn.send_answer(error_msg, transcript)
+            return
+        
+        # Get response from RAG service
+        response_text = ""
+        # Errors, timeouts and per-user answers must not be replayed to others
+        cacheable = False
+        # aclosing() runs the generator's cleanup as soon as we stop reading,
+        # instead of leaving it to the GC
+        async with aclosing(rag_service.query_stream(transcript, session_id)) as results:
+            async for result in results:
+                if result["type"] == "token":
+                    # Forward generated text as it arrives; the answer frame
+                    # below still carries the complete text
+                    await conn.send_chunk(result["text"])
+                elif result["type"] == "answer":
+                    # Use the generated answer
+                    response_text = result["answer"]
+                    cacheable = bool(result.get("cacheable"))
+                    break
+                elif result["type"] == "error":
+                    response_text = f"I'm having trouble processing your request: {result['message']}"
+                    logger.error("[%s] RAG Error: %s", session_id, result['message'])
+                    break
+        
+        # If no response from RAG, use default response
+        if not response_text:
+            response_text = "I don't have that information. Please contact Dr. B.C. Roy Engineering College Admissions at +91-343-2567890"
+        
+        logger.info("[%s] RAG Response generated in %.2fs: '%.50s...'", session_id, time.time() - process_start, response_text)
+        
+        # Update conversation memory with the response
+        conversation_memory.update_last_response(session_id, response_text)
+        
+        # Cache the full answer for later askers of the same question and
+        # for paraphrases of it
+        encoded_text = _cache_put(cache_key, response_text) if cacheable else None
+        if cacheable:
+            semantic_cache.add(transcript, response_text, query_vector)
+        
+        audio_url = cached_tts_url(response_text)
+        await conn.send_answer(response_text, transcript, encoded_text, audio_url)
+        logger.info("[%s] Response sent to client", session_id)
+        
+        # Pre-render the speech off the request path; an "audio" frame with
+        # its URL follows once it is on disk
+        if audio_url is None:
+            try:
+                conn.tts_queue.put_nowait(response_text)
+            except asyncio.QueueFull:
+                logger.warning("[%s] TTS queue full, skipping pre-render", session_id)
+            
+    except Exception as e:
+        logger.error("[%s] Error processing transcript: %s", session_id, e, exc_info=True)
+        error_msg = "Sorry, I encountered an error processing your request."
+        
+        await conn.send_answer(error_msg, transcript)
+
+async def _handle_interrupt(conn: _VoiceConnection, message_data: Optional[dict]) -> None:
+    # Handle interruption if needed
+    logger.info("[%s] Interruption received", conn.session_id)
+    # Could implement interruption logic here if needed
+
+# Message type -> handler; unknown types are ignored
+_DISPATCH = {
+    "transcript": _handle_transcript,
+    "interrupt": _handle_interrupt,
+}
 
 @router.websocket("")
 async def voice_websocket(websocket: WebSocket):
-    session_id = f"session_{int(time.time())}_{hash(websocket) % 10000}"
-    client_id = str(uuid4())
+    # Random 128-bit id: no collisions between concurrent connections
+    session_id = uuid4().hex
     start_time = time.time()
     
-    await websocket.accept()
-    logger.info(f"[{session_id}] WebSocket connected from {websocket.client} (Client ID: {client_id})")
+    # Binary MessagePack frames for clients that ask for them, JSON text otherwise
+    use_msgpack = msgpack is not None and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if use_msgpack else None)
+    logger.info("[%s] WebSocket connected from %s", session_id, websocket.client)
+    
+    conn = _VoiceConnection(websocket, session_id, use_msgpack)
     
     # Send ready message with session ID
-    await websocket.send_text(json.dumps({
-        "type": "ready",
-        "session_id": session_id
-    }))
+    await conn.send_ready()
     
     # Initialize conversation memory for this session
     conversation_memory.create_session(session_id)
     
+    conn.tts_worker = asyncio.create_task(_prerender_tts(conn))
+    
     try:
         while True:
             try:
                 # Receive message from client
-                data = await websocket.receive_text()
-                received_time = time.time()
-                # logger.debug(f"[{session_id}] Received data at {received_time:.3f}s: {data[:50]}...")
-                
-                message_data = json.loads(data)
+                if use_msgpack:
+                    raw = await websocket.receive_bytes()
+                    is_interrupt = raw[1:].startswith(INTERRUPT_MSGPACK_TAG)
+                else:
+                    raw = await websocket.receive_text()
+                    is_interrupt = raw.startswith(INTERRUPT_JSON_PREFIX)
                 
-                if message_data.get("type") == "transcript":
-                    transcript = message_data.get("text", "")
-                    
-                    if not transcript.strip():
-                        continue
-                        
-                    logger.info(f"[{session_id}] Processing transcript: '{transcript}'")
-                    
-                    # Add to conversation memory
-                    conversation_memory.add_interaction(
-                        session_id, 
-                        user_message=transcript, 
-                        bot_response=""
-                    )
-                    
-                    # Check if this query has been cached for this session
-                    cache_key = f"{session_id}:{transcript.lower().strip()}"
-                    
-                    if cache_key in audio_cache:
-                        logger.info(f"[{session_id}] Sending cached voice response")
-                        # Send cached response
-                        await websocket.send_text(json.dumps({
-                            "type": "answer",
-                            "text": audio_cache[cache_key], # Note: This seems to store text, not audio bytes based on original code usage
-                            "session_id": session_id
-                        }))
-                        continue
-                    
-                    # Send transcript back to confirm receipt
-                    await websocket.send_text(json.dumps({
-                        "type": "transcript",
-                        "text": transcript
-                    }))
-                    
-                    # Process the query using RAG
-                    process_start = time.time()
-                    try:
-                        # Check if Groq client is available
-                        if not settings.groq_client:
-                            error_msg = f"I'm having trouble connecting to the AI service. Please make sure your GROQ_API_KEY is set in the environment."
-                            log_msg = "GROQ_API_KEY not set"
-                            logger.error(f"[{session_id}] {log_msg}")
-                            await websocket.send_text(json.dumps({
-                                "type": "answer",
-                                "text": error_msg,
-                                "session_id": session_id
-                            }))
-                            continue
-                        
-                        # Set clients for RAG service
-                        college_config = {
-                            'name': settings.college_name,
-                            'admissions_phone': settings.admissions_phone,
-                            'support_email': settings.support_email
-                        }
-                        rag_service.set_clients(settings.groq_client, college_config)
-                        
-                        # Get response from RAG service
-                        response_text = ""
-                        async for result in rag_service.query_stream(transcript, session_id):
-                            if result["type"] == "answer":
-                                # Use the generated answer
-                                response_text = result["answer"]
-                                break
-                            elif result["type"] == "error":
-                                response_text = f"I'm having trouble processing your request: {result['message']}"
-                                logger.error(f"[{session_id}] RAG Error: {result['message']}")
-                                break
-                        
-                        # If no response from RAG, use default response
-                        if not response_text:
-                            response_text = "I don't have that information. Please contact Dr. B.C. Roy Engineering College Admissions at +91-343-2567890"
-                        
-                        logger.info(f"[{session_id}] RAG Response generated in {time.time() - process_start:.2f}s: '{response_text[:50]}...'")
-                        
-                        # Update conversation memory with the response
-                        conversation_memory.update_last_response(session_id, response_text)
-                        
-                        # Generate audio if not cached
-                        if cache_key not in audio_cache:
-                            # Convert response to speech
-                            try:
-                                tts_start = time.time()
-                                audio_bytes = await tts_service.text_to_speech(response_text)
-                                logger.info(f"[{session_id}] TTS generated in {time.time() - tts_start:.2f}s ({len(audio_bytes)} bytes)")
-                                
-                                # Cache the full answer for this session (Storing text as per original logic, though variable name suggests audio?)
-                                # Original code stored 'response_text' in 'audio_cache' (Dict[str, bytes] typed, but assigned str).
-                                # We will conform to existing logic but note the discrepancy.
-                                audio_cache[cache_key] = response_text
-                                
-                                # Send the answer to the client (Original code sends TEXT, not audio bytes?)
-                                # Based on 'voice.py' analysis, it sends: {"type": "answer", "text": response_text}
-                                # If the frontend expects audio, it is MISSING.
-                                # However, I will preserve existing behavior + Logging.
-                                await websocket.send_text(json.dumps({
-                                    "type": "answer",
-                                    "text": response_text,
-                                    "session_id": session_id
-                                    # "audio": base64? - Original code didn't have it.
-                                }))
-                                logger.info(f"[{session_id}] Response sent to client")
-                                
-                            except Exception as e:
-                                logger.error(f"[{session_id}] TTS error: {e}")
-                                
-                                # Send text-only response if TTS fails
-                                await websocket.send_text(json.dumps({
-                                    "type": "answer",
-                                    "text": response_text,
-                                    "session_id": session_id
-                                }))
-                        else:
-                            # Send cached response
-                            logger.info(f"[{session_id}] Sending cached response")
-                            await websocket.send_text(json.dumps({
-                                "type": "answer",
-                                "text": audio_cache[cache_key],
-                                "session_id": session_id
-                            }))
-                            
-                    except Exception as e:
-                        logger.error(f"[{session_id}] Error processing transcript: {e}", exc_info=True)
-                        error_msg = "Sorry, I encountered an error processing your request."
-                        
-                        await websocket.send_text(json.dumps({
-                            "type": "answer",
-                            "text": error_msg,
-                            "session_id": session_id
-                        }))
+                if is_interrupt:
+                    await _handle_interrupt(conn, None)
+                    continue
                 
-                elif message_data.get("type") == "interrupt":
-                    # Handle interruption if needed
-                    logger.info(f"[{session_id}] Interruption received")
-                    # Could implement interruption logic here if needed
+                message_data = msgpack.unpackb(raw, raw=False) if use_msgpack else json_utils.loads(raw)
+                handler = _DISPATCH.get(message_data.get("type"))
+                if handler is not None:
+                    await handler(conn, message_data)
                 
-            except json.JSONDecodeError:
-                logger.error(f"[{session_id}] Invalid JSON received")
+            except ValueError:
+                # JSONDecodeError and msgpack's unpack errors are both ValueErrors
+                logger.error("[%s] Invalid message received", session_id)
                 continue
             except WebSocketDisconnect:
                 break
             except Exception as e:
-                logger.error(f"[{session_id}] Error in websocket loop: {e}", exc_info=True)
+                logger.error("[%s] Error in websocket loop: %s", session_id, e, exc_info=True)
                 break
                 
     except WebSocketDisconnect:
         duration = time.time() - start_time
-        logger.info(f"[{session_id}] WebSocket disconnected after {duration:.2f}s")
+        logger.info("[%s] WebSocket disconnected after %.2fs", session_id, duration)
     except Exception as e:
-        logger.error(f"[{session_id}] Unexpected error in websocket: {e}", exc_info=True)
+        logger.error("[%s] Unexpected error in websocket: %s", session_id, e, exc_info=True)
     finally:
-        # Cleanup session data
-        conversation_memory.delete_session(session_id)
-        # Clear any cached audio for this session (optional)
-        keys_to_remove = [key for key in audio_cache if key.startswith(session_id)]
-        for key in keys_to_remove:
-            del audio_cache[key]
\ No newline at end of file
+        # Cleanup session data; wait for the TTS worker to finish cancelling so
+        # it never outlives the connection
+        conn.tts_worker.cancel()
+        await asyncio.gather(conn.tts_worker, return_exceptions=True)
+        rag_service.end_session(session_id)
@@ -1,5 +1,6 @@
 
 from datetime import datetime, timedelta
+import hmac
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -24,9 +25,9 @@ class TokenData(BaseModel):
 
 def verify_password(plain_password, hashed_password):
     # In a real DB scenario, we'd verify hash.
-    # Here we are comparing against a fixed admin password from env.
-    # To be secure, unexpected timing attacks etc, but for this scope:
-    return plain_password == hashed_password
+    # Here we are comparing against a fixed admin password from env,
+    # using a constant-time compare so response timing doesn't leak a prefix match.
+    return hmac.compare_digest(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
 
 def get_password_hash(password):
     return pwd_context.hash(password)
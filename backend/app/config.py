@@ -26,6 +26,14 @@ class Settings(BaseSettings):
     upload_dir: str = os.getenv("UPLOAD_DIR", "uploads")
     temp_audio_dir: str = os.getenv("TEMP_AUDIO_DIR", "temp_audio")
     
+    # Indent JSON state files (documents, conversation memory, user profiles)
+    # for reading by hand; compact by default, which writes about half the bytes
+    pretty_json_state: bool = os.getenv("PRETTY_JSON_STATE", "").lower() in ("1", "true", "yes")
+    
+    # Rate limit counters. memory:// counts per worker process; point this at
+    # Redis (e.g. redis://redis:6379/0) so limits hold across workers/instances
+    rate_limit_storage_uri: str = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+    
     # CORS settings
     cors_origins: List[str] = ["*"]  # In production, specify exact origins
     
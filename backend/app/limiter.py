@@ -1,7 +1,9 @@
-
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
+from app.config import settings
+
 # Create limiter instance
-# Uses remote address (IP) to identify client
-limiter = Limiter(key_func=get_remote_address)
+# Uses remote address (IP) to identify client. With a redis:// storage URI each
+# check is a single atomic INCR + EXPIRE script call shared by all workers
+limiter = Limiter(key_func=get_remote_address, storage_uri=settings.rate_limit_storage_uri)
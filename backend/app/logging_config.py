@@ -1,18 +1,75 @@
 
+import atexit
+import copy
 import logging
 import logging.handlers
 import json
 import os
+import queue
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
+
+# msgspec is optional; without it records are encoded with the stdlib json module
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if msgspec is not None:
+    class LogRecordStruct(msgspec.Struct, omit_defaults=True):
+        """Typed log line for msgspec's encoder (field order is the output order)"""
+        timestamp: str
+        level: str
+        logger: str
+        message: str
+        module: str
+        function: Optional[str]
+        line: int
+        exception: Optional[str] = None
 
 class JSONFormatter(logging.Formatter):
     """
     Formatter that dumps the log record as a JSON object.
     """
+    def __init__(self):
+        super().__init__()
+        self._encoder = msgspec.json.Encoder() if msgspec is not None else None
+        # ISO prefix of the last whole second seen; records within the same
+        # second only need their microseconds appended
+        self._ts_second = None
+        self._ts_prefix = ""
+
+    def _timestamp(self, created: float) -> str:
+        second = int(created)
+        micro = round((created - second) * 1e6)
+        if micro >= 1_000_000:
+            return datetime.utcfromtimestamp(created).isoformat()
+        if second != self._ts_second:
+            self._ts_prefix = datetime.utcfromtimestamp(second).isoformat()
+            self._ts_second = second
+        # Matches datetime.isoformat(), which omits a zero fraction
+        return f"{self._ts_prefix}.{micro:06d}" if micro else self._ts_prefix
+
     def format(self, record):
+        # When the record was made, not when the listener thread got to it
+        timestamp = self._timestamp(record.created)
+        exception = self.formatException(record.exc_info) if record.exc_info else None
+        
+        if self._encoder is not None:
+            return self._encoder.encode(LogRecordStruct(
+                timestamp=timestamp,
+                level=record.levelname,
+                logger=record.name,
+                message=record.getMessage(),
+                module=record.module,
+                function=record.funcName,
+                line=record.lineno,
+                exception=exception
+            )).decode("utf-8")
+        
         log_obj = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": timestamp,
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -21,15 +78,35 @@ class JSONFormatter(logging.Formatter):
             "line": record.lineno
         }
         
-        if record.exc_info:
-            log_obj["exception"] = self.formatException(record.exc_info)
+        if exception:
+            log_obj["exception"] = exception
             
         return json.dumps(log_obj)
 
+class _StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves records structured for JSONFormatter.
+
+    The stock prepare() formats the record into its message and drops
+    exc_info; here only the arguments are merged (they may be mutated after
+    the call returns) and the exception stays for the formatter.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+# Writes queued records to the log files on a background thread
+_queue_listener = None
+
 def setup_logging(log_dir: str = "logs", log_level: str = "INFO"):
     """
     Configure logging to write to console and rotating file.
+    File writes (and rotation) happen on a QueueListener thread, so logging
+    from the event loop never waits on disk.
     """
+    global _queue_listener
     log_path = Path(log_dir)
     log_path.mkdir(exist_ok=True)
     
@@ -39,6 +116,9 @@ def setup_logging(log_dir: str = "logs", log_level: str = "INFO"):
     
     # Clear existing handlers
     logger.handlers = []
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
     
     # Console Handler (Human readable)
     console_handler = logging.StreamHandler()
@@ -54,7 +134,6 @@ def setup_logging(log_dir: str = "logs", log_level: str = "INFO"):
         encoding="utf-8"
     )
     file_handler.setFormatter(JSONFormatter())
-    logger.addHandler(file_handler)
     
     # Error File Handler (Separate file for errors)
     error_handler = logging.handlers.RotatingFileHandler(
@@ -65,7 +144,14 @@ def setup_logging(log_dir: str = "logs", log_level: str = "INFO"):
     )
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(JSONFormatter())
-    logger.addHandler(error_handler)
+    
+    # The root logger only enqueues; the listener fans records out to both files
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_StructuredQueueHandler(log_queue))
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue, file_handler, error_handler, respect_handler_level=True
+    )
+    _queue_listener.start()
     
     
     # Configure granular logging for Voice and TTS
@@ -74,3 +160,9 @@ def setup_logging(log_dir: str = "logs", log_level: str = "INFO"):
     
     logging.info("Logging configured successfully")
 
+@atexit.register
+def _stop_queue_listener():
+    """Flush queued records to disk on interpreter exit."""
+    if _queue_listener is not None:
+        _queue_listener.stop()
+
@@ -1,9 +1,12 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.api import qa, voice
+import asyncio
 import logging
 import os
+import time
 from uuid import uuid4
 
 from app.logging_config import setup_logging
@@ -41,8 +44,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Ensure temp audio directory exists
-os.makedirs(settings.temp_audio_dir, exist_ok=True)
+# Compress JSON responses (answers plus source snippets can be several KB).
+# Level 1: most of the size win for a fraction of the CPU
+class JSONGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that passes audio through untouched: MP3 is already compressed"""
+    AUDIO_PATHS = ("/audio/", "/qa/tts")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.AUDIO_PATHS):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024, compresslevel=1)
+
+# Ensure data directories exist once at startup so handlers don't re-check per request
+for directory in (settings.upload_dir, settings.temp_audio_dir, settings.chroma_persist_dir):
+    os.makedirs(directory, exist_ok=True)
 
 # Mount static directory for audio files
 app.mount("/audio", StaticFiles(directory=settings.temp_audio_dir), name="audio")
@@ -56,6 +74,18 @@ app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(auth_routes.router, tags=["auth"])
 app.include_router(admin.router, prefix="/admin", tags=["admin"])
 
+@app.on_event("startup")
+async def configure_rag_clients():
+    """Wire the shared RAG service to the LLM client once, not per request/message"""
+    qa.rag_service.set_clients(settings.groq_client, qa.college_config)
+
+@app.on_event("startup")
+async def warm_up_embedder():
+    """Take the embedding model's cold start at boot instead of on the first query"""
+    start = time.time()
+    await asyncio.to_thread(qa.rag_service.hybrid_retriever.vector_store.warmup)
+    logger.info("Embedding model warmed up in %.2fs", time.time() - start)
+
 @app.get("/")
 async def root():
     return {"message": "College Voice Agent API is running!"}
@@ -66,4 +96,19 @@ async def health():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Keep permessage-deflate on: every WebSocket frame is JSON text, which
+    # compresses well. Audio never goes over the socket (clients fetch it from
+    # /qa/tts and /audio), so there are no MP3 frames to waste deflate CPU on
+    # loop="auto" resolves to uvloop wherever it is installed (uvicorn[standard]
+    # ships it everywhere but Windows, which has no uvloop build) and to asyncio
+    # otherwise. log_config=None: setup_logging() already configured logging
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="httptools",
+        ws="websockets",
+        ws_per_message_deflate=True,
+        log_config=None,
+    )
@@ -49,7 +49,7 @@ class BackupService:
                         shutil.copy2(target, dest)
                         files_count += 1
                 else:
-                    logger.warning(f"Backup target not found: {target}")
+                    logger.warning("Backup target not found: %s", target)
             
             # Zip the temp dir
             zip_path = shutil.make_archive(str(backup_path), 'zip', temp_dir)
@@ -57,7 +57,7 @@ class BackupService:
             # Cleanup temp
             shutil.rmtree(temp_dir)
             
-            logger.info(f"Backup created successfully: {zip_path}")
+            logger.info("Backup created successfully: %s", zip_path)
             
             return {
                 "filename": f"{backup_name}.zip",
@@ -68,7 +68,7 @@ class BackupService:
             }
             
         except Exception as e:
-            logger.error(f"Backup failed: {e}")
+            logger.error("Backup failed: %s", e)
             raise Exception(f"Backup failed: {e}")
 
     def list_backups(self) -> List[Dict]:
@@ -95,6 +95,6 @@ class BackupService:
         file_path = self.backup_dir / filename
         if file_path.exists():
             os.remove(file_path)
-            logger.info(f"Deleted backup: {filename}")
+            logger.info("Deleted backup: %s", filename)
             return True
         return False
@@ -0,0 +1,243 @@
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+# numba is optional; without it the kernels below are replaced by numpy
+# equivalents that do the same work per posting list / score vector
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+# Larger top-k requests go through argpartition instead of the heap kernel
+HEAP_TOPK_MAX = 64
+
+
+def _bm25_accumulate(scores, doc_ids, weights, bounds):
+    """
+    Add each query term's precomputed BM25 weights to the documents in its
+    posting list; bounds holds one (start, stop) slice of the flat postings
+    per term, so a whole query is a single call.
+    """
+    for t in range(bounds.shape[0]):
+        for j in range(bounds[t, 0], bounds[t, 1]):
+            scores[doc_ids[j]] += weights[j]
+
+
+def _topk(scores, k):
+    """
+    Indices of the k highest scores, best first. Ties go to the lower index,
+    matching np.argsort(-scores, kind='stable').
+    """
+    n = scores.shape[0]
+    if k > n:
+        k = n
+    heap = np.empty(k, dtype=np.int64)
+    size = 0
+    for i in range(n):
+        s = scores[i]
+        if size < k:
+            # Sift up: the root holds the worst kept entry (lowest score, highest index)
+            pos = size
+            size += 1
+            while pos > 0:
+                parent = (pos - 1) // 2
+                p = heap[parent]
+                if scores[p] < s or (scores[p] == s and p > i):
+                    break
+                heap[pos] = p
+                pos = parent
+            heap[pos] = i
+        elif s > scores[heap[0]]:
+            # Replace the root and sift down
+            pos = 0
+            while True:
+                child = 2 * pos + 1
+                if child >= size:
+                    break
+                c = heap[child]
+                if child + 1 < size:
+                    r = heap[child + 1]
+                    if scores[r] < scores[c] or (scores[r] == scores[c] and r > c):
+                        child += 1
+                        c = r
+                if s < scores[c] or (s == scores[c] and i > c):
+                    break
+                heap[pos] = c
+                pos = child
+            heap[pos] = i
+
+    # Insertion sort of the k survivors into rank order (k is small)
+    out = heap[:size].copy()
+    for a in range(1, size):
+        x = out[a]
+        b = a - 1
+        while b >= 0 and (scores[out[b]] < scores[x] or (scores[out[b]] == scores[x] and out[b] > x)):
+            out[b + 1] = out[b]
+            b -= 1
+        out[b + 1] = x
+    return out
+
+
+def _bm25_accumulate_numpy(scores, doc_ids, weights, bounds):
+    """_bm25_accumulate with one array expression per term (a posting list names each document once)."""
+    for start, stop in bounds.tolist():
+        scores[doc_ids[start:stop]] += weights[start:stop]
+
+
+def _topk_numpy(scores, k):
+    """
+    _topk via argpartition: only scores at or above the k-th best are sorted,
+    and stably, so ties still go to the lower index.
+    """
+    n = scores.shape[0]
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    candidates = np.flatnonzero(scores >= threshold)
+    return candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+
+
+if NUMBA_AVAILABLE:
+    _bm25_accumulate = numba.njit(cache=True, nogil=True)(_bm25_accumulate)
+    _topk = numba.njit(cache=True, nogil=True)(_topk)
+else:
+    _bm25_accumulate = _bm25_accumulate_numpy
+    _topk = _topk_numpy
+
+
+def warmup() -> None:
+    """Compile the kernels now so the first query doesn't pay the JIT cost."""
+    scores = np.zeros(2, dtype=np.float64)
+    _bm25_accumulate(
+        scores,
+        np.zeros(1, dtype=np.int32),
+        np.ones(1, dtype=np.float64),
+        np.array([[0, 1]], dtype=np.int64),
+    )
+    topk(scores, 1)
+
+
+def topk(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (stable on ties)."""
+    scores = np.ascontiguousarray(scores, dtype=np.float64)
+    if k > HEAP_TOPK_MAX or k <= 0:
+        # The heap kernel's final insertion sort is quadratic in k, and it
+        # assumes a non-empty heap
+        return _topk_numpy(scores, k)
+    return _topk(scores, k)
+
+
+class BM25Scorer:
+    """
+    BM25 (Okapi) scoring over flat posting arrays (doc ids, weights), with
+    each term's postings a contiguous slice, accumulated by the Numba kernel
+    or its numpy equivalent.
+
+    Scores match rank_bm25's BM25Okapi (ATIRE idf, floored at epsilon times
+    the average idf), but a query only walks its own terms' postings. Each
+    posting's weight is its full term contribution (idf, tf saturation and
+    length normalization), so a query only adds.
+
+    Scorers are immutable: with_documents/without_documents return a new
+    scorer, so retrieval threads keep using the old one while it is built.
+    Only the added documents are tokenized and counted; the corpus-wide
+    statistics are then recomputed over the posting arrays in numpy.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab: Dict[str, int] = {}
+        # Postings sorted by (term id, doc id)
+        self._terms = np.empty(0, dtype=np.int32)
+        self.doc_ids = np.empty(0, dtype=np.int32)
+        self._tfs = np.empty(0, dtype=np.float64)
+        self.doc_len = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        # (start, stop) of each term id's slice of the postings
+        self.bounds = np.empty((0, 2), dtype=np.int64)
+
+    @property
+    def n_docs(self) -> int:
+        return self.doc_len.shape[0]
+
+    def with_documents(self, tokenized_docs: List[List[str]]) -> "BM25Scorer":
+        """A scorer over this one's documents followed by tokenized_docs."""
+        vocab = dict(self.vocab)
+        terms: List[int] = []
+        doc_ids: List[int] = []
+        tfs: List[int] = []
+        for doc_id, tokens in enumerate(tokenized_docs, start=self.n_docs):
+            for term, tf in Counter(tokens).items():
+                term_id = vocab.get(term)
+                if term_id is None:
+                    term_id = vocab[term] = len(vocab)
+                terms.append(term_id)
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        all_terms = np.concatenate([self._terms, np.asarray(terms, dtype=np.int32)])
+        # Stable, so each term's postings stay in doc id order: existing ones,
+        # then the new documents'
+        order = np.argsort(all_terms, kind='stable')
+        return self._derive(
+            vocab,
+            all_terms[order],
+            np.concatenate([self.doc_ids, np.asarray(doc_ids, dtype=np.int32)])[order],
+            np.concatenate([self._tfs, np.asarray(tfs, dtype=np.float64)])[order],
+            np.concatenate([self.doc_len, np.fromiter(map(len, tokenized_docs), dtype=np.float64, count=len(tokenized_docs))]),
+        )
+
+    def without_documents(self, keep: np.ndarray) -> "BM25Scorer":
+        """A scorer over only the documents where the boolean mask keep is set, renumbered in order."""
+        kept = keep[self.doc_ids]
+        new_ids = np.cumsum(keep, dtype=np.int64) - 1
+        return self._derive(
+            self.vocab,
+            self._terms[kept],
+            new_ids[self.doc_ids[kept]].astype(np.int32),
+            self._tfs[kept],
+            self.doc_len[keep],
+        )
+
+    def _derive(self, vocab, terms, doc_ids, tfs, doc_len) -> "BM25Scorer":
+        scorer = BM25Scorer(self.k1, self.b, self.epsilon)
+        scorer.vocab = vocab
+        scorer._terms = terms
+        scorer.doc_ids = doc_ids
+        scorer._tfs = tfs
+        scorer.doc_len = doc_len
+
+        n_terms = len(vocab)
+        starts = np.searchsorted(terms, np.arange(n_terms + 1))
+        scorer.bounds = np.stack([starts[:-1], starts[1:]], axis=1)
+        if not scorer.n_docs:
+            return scorer
+
+        # Terms no longer in any document are left out of the idf average,
+        # as they would be absent from a freshly built BM25Okapi
+        df = np.diff(starts)
+        present = df > 0
+        idf = np.zeros(n_terms, dtype=np.float64)
+        idf[present] = np.log(scorer.n_docs - df[present] + 0.5) - np.log(df[present] + 0.5)
+        if present.any():
+            idf[present & (idf < 0)] = self.epsilon * idf[present].mean()
+
+        # Length normalization depends only on the document
+        norms = self.k1 * (1.0 - self.b + self.b * doc_len / doc_len.mean())
+        scorer.weights = idf[terms] * (tfs * (self.k1 + 1.0)) / (tfs + norms[doc_ids])
+        return scorer
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        term_ids = [self.vocab[term] for term in query_tokens if term in self.vocab]
+        if term_ids:
+            _bm25_accumulate(scores, self.doc_ids, self.weights, self.bounds[term_ids])
+        return scores
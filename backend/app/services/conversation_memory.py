@@ -1,125 +1,352 @@
-import json
+import atexit
+import hashlib
+import os
+import threading
 import time
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 import logging
 
+from app import json_utils
+from app.config import settings
+
 logger = logging.getLogger(__name__)
 
+# Fold a log into its snapshot once it is this many times the snapshot's size
+# (and at least COMPACT_MIN_BYTES)
+COMPACT_RATIO = 4
+COMPACT_MIN_BYTES = 256 * 1024
+
+class _EventLog:
+    """
+    A JSON snapshot plus an append-only JSONL log of changes made since.
+
+    Each change is one appended line, so a write costs O(change) instead of
+    re-encoding the whole state. Events must be absolute (set this index, drop
+    this key) so replaying them over a snapshot that already includes them is
+    harmless: a crash between writing a snapshot and truncating the log only
+    replays the log again.
+
+    Appends only buffer the line; a background thread writes whatever has
+    accumulated every flush_interval_ms, so a burst of changes costs one
+    write() (and one fsync, if enabled) instead of one each.
+    """
+    def __init__(self, snapshot_file: Path, flush_interval_ms: int = 100, fsync: bool = False):
+        self.snapshot_file = snapshot_file
+        self.log_file = snapshot_file.with_suffix(".jsonl")
+        self.fsync = fsync
+        self._fh = None
+        # Lines not yet written, and an empty buffer to swap in when flushing,
+        # so both are reused instead of allocated per write
+        self._pending = bytearray()
+        self._spare = bytearray()
+        # _lock guards the buffers and counters; _io_lock serializes flushes
+        # with snapshotting, which truncates the log under the flusher
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._log_bytes = 0
+        self._snapshot_bytes = 0
+        # Digest of the snapshot on disk, so rewriting identical state is skipped
+        self._snapshot_digest = None
+
+        self._flush_interval = flush_interval_ms / 1000
+        self._flusher = threading.Thread(target=self._run_flusher, name=f"flush-{self.log_file.name}", daemon=True)
+        self._flusher.start()
+
+    def load(self) -> Tuple[Dict, List[Dict]]:
+        """Return (snapshot, events) as stored on disk."""
+        snapshot = {}
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                data = f.read()
+            self._snapshot_bytes = len(data)
+            self._snapshot_digest = hashlib.blake2b(data, digest_size=16).digest()
+            snapshot = json_utils.loads(data)
+            if not isinstance(snapshot, dict):
+                snapshot = {}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("Error loading %s: %s", self.snapshot_file, e)
+
+        events = []
+        try:
+            with open(self.log_file, 'rb') as f:
+                for line in f:
+                    self._log_bytes += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        events.append(json_utils.loads(line))
+                    except json_utils.JSONDecodeError:
+                        # Most likely a write cut short by a crash
+                        logger.warning("Skipping corrupt line in %s", self.log_file)
+        except FileNotFoundError:
+            pass
+        return snapshot, events
+
+    def append(self, event: Dict) -> bool:
+        """Queue one event for the log. Returns True once the log is due for compaction."""
+        line = json_utils.dumps(event)
+        with self._lock:
+            self._pending += line
+            self._pending += b"\n"
+            self._log_bytes += len(line) + 1
+            return self._log_bytes > max(self._snapshot_bytes * COMPACT_RATIO, COMPACT_MIN_BYTES)
+
+    def flush(self) -> None:
+        """Write queued events to the log now."""
+        with self._io_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                buf = self._pending
+                self._pending, self._spare = self._spare, buf
+            try:
+                if self._fh is None:
+                    self.log_file.parent.mkdir(parents=True, exist_ok=True)
+                    # Unbuffered O_APPEND: each flush is a single write()
+                    self._fh = open(self.log_file, 'ab', buffering=0)
+                self._fh.write(buf)
+                if self.fsync:
+                    os.fsync(self._fh.fileno())
+            finally:
+                buf.clear()
+
+    def _run_flusher(self) -> None:
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error writing %s: %s", self.log_file, e)
+
+    def write_snapshot(self, state: Dict) -> None:
+        """Replace the snapshot with state and empty the log."""
+        with self._io_lock:
+            # The snapshot covers every queued event, so they need not be written
+            with self._lock:
+                self._pending.clear()
+                self._log_bytes = 0
+
+            self.snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+            data = json_utils.dumps(state, indent=settings.pretty_json_state)
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+            if digest != self._snapshot_digest:
+                # Write-then-rename: a crash leaves the old snapshot, never a torn one
+                tmp_file = self.snapshot_file.with_suffix(".json.tmp")
+                with open(tmp_file, 'wb') as f:
+                    f.write(data)
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                os.replace(tmp_file, self.snapshot_file)
+                self._snapshot_bytes = len(data)
+                self._snapshot_digest = digest
+
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            with open(self.log_file, 'wb'):
+                pass
+
+def _new_session() -> Dict[str, list]:
+    """An empty session: parallel timestamp / user message / bot response columns."""
+    return {"ts": [], "u": [], "b": []}
+
+def _interactions(session: Dict[str, list], rows: slice = slice(None)) -> List[Dict]:
+    """Build interaction dicts from the given rows of a session's columns."""
+    return [
+        {"timestamp": ts, "user_message": u, "bot_response": b}
+        for ts, u, b in zip(session["ts"][rows], session["u"][rows], session["b"][rows])
+    ]
+
 class ConversationMemory:
-    def __init__(self, storage_file: str = "chroma_db/conversation_memory.json"):
+    """
+    Per-session conversation history plus user profiles.
+
+    Each session is stored as columns ({"ts": [...], "u": [...], "b": [...]})
+    rather than a list of per-interaction dicts: appends and updates touch
+    plain lists, the snapshot doesn't repeat key names for every interaction,
+    and dicts are only built for the interactions a caller asks for.
+    """
+    def __init__(self, storage_file: str = "chroma_db/conversation_memory.json",
+                 flush_interval_ms: int = 100, fsync: bool = False):
         self.storage_file = Path(storage_file)
         self.storage_file.parent.mkdir(exist_ok=True)
-        self.sessions: Dict[str, List[Dict]] = self._load_memory()
+        # Changes reach disk within flush_interval_ms; fsync makes each flush durable
+        self._session_log = _EventLog(self.storage_file, flush_interval_ms, fsync)
+        self._profile_log = _EventLog(Path("chroma_db/user_profiles.json"), flush_interval_ms, fsync)
+        atexit.register(self.flush)
+        self.sessions: Dict[str, Dict[str, list]] = self._load_memory()
         # Initialize user profiles for storing preferences like WBJEE rank, interests, etc.
         self.user_profiles: Dict[str, Dict] = self._load_user_profiles()
     
-    def _load_memory(self) -> Dict[str, List[Dict]]:
-        """Load conversation memory from file."""
-        try:
-            if self.storage_file.exists():
-                with open(self.storage_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return data if isinstance(data, dict) else {}
-            else:
-                return {}
-        except Exception as e:
-            logger.error(f"Error loading conversation memory: {e}")
-            return {}
+    def _load_memory(self) -> Dict[str, Dict[str, list]]:
+        """Load conversation memory: the snapshot with the change log replayed over it."""
+        sessions, events = self._session_log.load()
+        for session_id, session in sessions.items():
+            if isinstance(session, list):
+                # Snapshot written before sessions were stored as columns
+                sessions[session_id] = {
+                    "ts": [interaction.get("timestamp") for interaction in session],
+                    "u": [interaction.get("user_message", "") for interaction in session],
+                    "b": [interaction.get("bot_response", "") for interaction in session]
+                }
+        for event in events:
+            try:
+                self._apply_session_event(sessions, event)
+            except (KeyError, IndexError, TypeError) as e:
+                logger.warning("Skipping conversation memory event %s: %s", event, e)
+        return sessions
+    
+    @staticmethod
+    def _apply_session_event(sessions: Dict[str, Dict[str, list]], event: Dict) -> None:
+        op = event["op"]
+        if op == "add":
+            session = sessions.get(event["sid"])
+            if session is None:
+                session = sessions[event["sid"]] = _new_session()
+            index = event["i"]
+            for column in ("ts", "u", "b"):
+                if index < len(session[column]):
+                    session[column][index] = event[column]
+                else:
+                    session[column].append(event[column])
+        elif op == "upd":
+            sessions[event["sid"]]["b"][event["i"]] = event["b"]
+        elif op == "create":
+            if event["sid"] not in sessions:
+                sessions[event["sid"]] = _new_session()
+        elif op == "del":
+            sessions.pop(event["sid"], None)
+        elif op == "clear":
+            sessions.clear()
     
     def _load_user_profiles(self) -> Dict[str, Dict]:
-        """Load user profiles from a separate file."""
-        profile_file = Path("chroma_db/user_profiles.json")
+        """Load user profiles: the snapshot with the change log replayed over it."""
+        profiles, events = self._profile_log.load()
+        for event in events:
+            try:
+                op = event["op"]
+                if op == "set":
+                    profiles.setdefault(event["sid"], {})[event["k"]] = event["v"]
+                elif op == "del":
+                    profiles.pop(event["sid"], None)
+                elif op == "clear":
+                    profiles.clear()
+            except (KeyError, TypeError) as e:
+                logger.warning("Skipping user profile event %s: %s", event, e)
+        return profiles
+    
+    def _log_profile_event(self, event: Dict):
+        """Record one user profile change."""
         try:
-            if profile_file.exists():
-                with open(profile_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return data if isinstance(data, dict) else {}
-            else:
-                return {}
+            if self._profile_log.append(event):
+                self._profile_log.write_snapshot(self.user_profiles)
         except Exception as e:
-            logger.error(f"Error loading user profiles: {e}")
-            return {}
+            logger.error("Error saving user profiles: %s", e)
     
-    def _save_user_profiles(self):
-        """Save user profiles to file."""
-        profile_file = Path("chroma_db/user_profiles.json")
+    def _log_session_event(self, event: Dict):
+        """Record one conversation memory change."""
         try:
-            with open(profile_file, 'w', encoding='utf-8') as f:
-                json.dump(self.user_profiles, f, ensure_ascii=False, indent=2)
+            if self._session_log.append(event):
+                self._session_log.write_snapshot(self.sessions)
         except Exception as e:
-            logger.error(f"Error saving user profiles: {e}")
+            logger.error("Error saving conversation memory: %s", e)
+    
+    def flush(self):
+        """Write any buffered changes to disk now."""
+        for log in (self._session_log, self._profile_log):
+            try:
+                log.flush()
+            except Exception as e:
+                logger.error("Error writing %s: %s", log.log_file, e)
     
-    def _save_memory(self):
-        """Save conversation memory to file."""
+    def compact(self):
+        """Fold both change logs into their snapshots."""
         try:
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(self.sessions, f, ensure_ascii=False, indent=2)
+            self._session_log.write_snapshot(self.sessions)
+            self._profile_log.write_snapshot(self.user_profiles)
         except Exception as e:
-            logger.error(f"Error saving conversation memory: {e}")
+            logger.error("Error compacting conversation memory: %s", e)
     
     def create_session(self, session_id: str):
         """Create a new conversation session."""
         if session_id not in self.sessions:
-            self.sessions[session_id] = []
-            self._save_memory()
+            self.sessions[session_id] = _new_session()
+            self._log_session_event({"op": "create", "sid": session_id})
     
     def add_interaction(self, session_id: str, user_message: str, bot_response: str):
         """Add a user-bot interaction to the conversation memory."""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
-        
-        interaction = {
-            "timestamp": time.time(),
-            "user_message": user_message,
-            "bot_response": bot_response
-        }
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = _new_session()
         
-        self.sessions[session_id].append(interaction)
-        self._save_memory()
+        timestamp = time.time()
+        session["ts"].append(timestamp)
+        session["u"].append(user_message)
+        session["b"].append(bot_response)
+        self._log_session_event({
+            "op": "add",
+            "sid": session_id,
+            "i": len(session["b"]) - 1,
+            "ts": timestamp,
+            "u": user_message,
+            "b": bot_response
+        })
     
     def get_session_history(self, session_id: str, limit: int = 5) -> List[Dict]:
         """Get recent conversation history for a session."""
-        if session_id in self.sessions:
-            # Return last 'limit' interactions
-            return self.sessions[session_id][-limit:]
-        return []
+        session = self.sessions.get(session_id)
+        if session is None:
+            return []
+        # Return last 'limit' interactions; only these are built as dicts
+        return _interactions(session, slice(-limit, None))
     
     def update_last_response(self, session_id: str, new_response: str):
         """Update the last bot response in the conversation."""
-        if session_id in self.sessions and self.sessions[session_id]:
-            last_interaction = self.sessions[session_id][-1]
-            last_interaction["bot_response"] = new_response
-            self._save_memory()
+        session = self.sessions.get(session_id)
+        if session and session["b"]:
+            responses = session["b"]
+            if responses[-1] == new_response:
+                return
+            responses[-1] = new_response
+            self._log_session_event({
+                "op": "upd",
+                "sid": session_id,
+                "i": len(responses) - 1,
+                "b": new_response
+            })
     
     def delete_session(self, session_id: str):
         """Delete a conversation session."""
         if session_id in self.sessions:
             del self.sessions[session_id]
-            self._save_memory()
+            self._log_session_event({"op": "del", "sid": session_id})
         # Also delete user profile for this session if exists
         if session_id in self.user_profiles:
             del self.user_profiles[session_id]
-            self._save_user_profiles()
+            self._log_profile_event({"op": "del", "sid": session_id})
     
     def get_all_sessions(self) -> Dict[str, List[Dict]]:
         """Get all conversation sessions."""
-        return self.sessions.copy()
+        return {session_id: _interactions(session) for session_id, session in self.sessions.items()}
     
     def clear_memory(self):
         """Clear all conversation memory."""
         self.sessions = {}
         self.user_profiles = {}
-        self._save_memory()
-        self._save_user_profiles()
+        self.compact()
     
     def update_user_profile(self, session_id: str, key: str, value: any):
         """Update user profile with specific information like rank, interests, etc."""
         if session_id not in self.user_profiles:
             self.user_profiles[session_id] = {}
+        elif key in self.user_profiles[session_id] and self.user_profiles[session_id][key] == value:
+            return
         
         self.user_profiles[session_id][key] = value
-        self._save_user_profiles()
+        self._log_profile_event({"op": "set", "sid": session_id, "k": key, "v": value})
     
     def get_user_profile(self, session_id: str) -> Dict:
         """Get user profile for a session."""
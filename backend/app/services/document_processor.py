@@ -1,9 +1,20 @@
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+import asyncio
+import functools
 import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import json
+import csv
 import re
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+import numpy as np
 
 # Import optional dependencies
 try:
@@ -11,6 +22,13 @@ try:
 except ImportError:
     pypdf = None
 
+# pypdfium2 (PDFium, C++) extracts text many times faster than pypdf and is
+# preferred when installed
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
 try:
     import pandas as pd
 except ImportError:
@@ -21,8 +39,255 @@ try:
 except ImportError:
     openpyxl = None
 
+# pysbd knows abbreviations, decimals and initials; without it sentences are
+# split on terminal punctuation alone
+try:
+    import pysbd
+except ImportError:
+    pysbd = None
+
 logger = logging.getLogger(__name__)
 
+# Extension dispatch sets, built once rather than as list literals per file
+SPREADSHEET_EXTENSIONS = frozenset({'.csv', '.xlsx', '.xls'})
+OPENPYXL_EXTENSIONS = frozenset({'.xlsx', '.xlsm'})
+
+# Chunking patterns, compiled once instead of looked up in re's cache per call.
+# _RE_WS collapses runs of spaces/tabs to one space; it skips lone spaces,
+# which would be replaced by themselves, so ordinary prose has no matches
+_RE_WS = re.compile(r'\t[ \t]*| [ \t]+')
+_RE_PARA = re.compile(r'\n\s*\n')
+_RE_SENT = re.compile(r'(?<=[.!?])\s+')
+
+@functools.cache
+def _get_segmenter():
+    """
+    The pysbd segmenter, built on first use and then shared by every file this
+    process chunks (pool workers each build their own once).
+    """
+    return pysbd.Segmenter(language="en", clean=False)
+
+def _iter_paragraphs(text: str) -> Iterator[str]:
+    """
+    Yield the pieces of text between paragraph breaks, as _RE_PARA.split
+    would, but from one finditer scan without materializing the whole list.
+    """
+    start = 0
+    for match in _RE_PARA.finditer(text):
+        yield text[start:match.start()]
+        start = match.end()
+    yield text[start:]
+
+# Where an overlong sentence (typically a spreadsheet row dump) may be cut
+_RE_BREAK = re.compile(r'[\n ]')
+
+def _split_long(text: str, size: int) -> List[str]:
+    """
+    Cut text into pieces of roughly size characters. Each cut is moved back
+    to the last newline/space in the second half of its window, if any. All
+    windows are resolved at once with searchsorted over the break offsets.
+    """
+    # Offsets of the break characters themselves: a piece ends just before
+    # one and the next starts just after, so pieces are sliced out already
+    # trimmed (str.strip returns the same object when there's nothing to do)
+    breaks = np.fromiter((m.start() for m in _RE_BREAK.finditer(text)), dtype=np.int64)
+    stops = np.arange(size, len(text), size, dtype=np.int64)
+    starts = stops
+    if breaks.size and stops.size:
+        idx = np.searchsorted(breaks, stops, side='right') - 1
+        best = breaks[np.maximum(idx, 0)]
+        at_break = (idx >= 0) & (best > stops - size // 2)
+        stops = np.where(at_break, best, stops)
+        starts = stops + at_break
+    pieces = (
+        text[start:stop].strip()
+        for start, stop in zip([0, *starts.tolist()], [*stops.tolist(), len(text)])
+    )
+    return [piece for piece in pieces if piece]
+
+def _split_sentences(text: str) -> List[str]:
+    """Split a paragraph into sentences, without surrounding whitespace."""
+    if pysbd is None:
+        return _RE_SENT.split(text)
+    return [sentence for sentence in map(str.strip, _get_segmenter().segment(text)) if sentence]
+
+# PDFs with at least this many pages have their text extracted on a process
+# pool, PDF_PAGES_PER_TASK pages per task; smaller ones aren't worth the IPC
+PDF_PARALLEL_MIN_PAGES = 32
+PDF_PAGES_PER_TASK = 16
+
+# Shared by every DocumentProcessor for PDF page ranges and whole files,
+# created on first use
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+# Pool size, capped like the callers' own file concurrency
+PROCESS_POOL_WORKERS = min(8, os.cpu_count() or 1)
+
+# Set in pool workers: a file processed there extracts its pages serially
+# rather than fanning out to a pool of its own
+_in_pool_worker = False
+
+def _mark_pool_worker() -> None:
+    global _in_pool_worker, _pdfium_lock
+    _in_pool_worker = True
+    # A fresh lock for this process: one inherited from a parent thread
+    # that held it at fork time would stay locked forever
+    _pdfium_lock = threading.Lock()
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # Workers come from a forkserver (spawn where there is none, e.g.
+        # Windows) rather than forking the server: a fork would copy its
+        # threads' held locks, the embedding model and the FAISS index into
+        # every worker
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PROCESS_POOL_WORKERS,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_mark_pool_worker
+        )
+    return _process_pool
+
+def _join_pages(pages: List[Optional[str]]) -> str:
+    """Document text: each non-empty page followed by a newline, built in one join."""
+    pages = [page for page in pages if page]
+    return "\n".join(pages) + "\n" if pages else ""
+
+# SpreadsheetML namespaces, for reading .xlsx parts directly
+_XLSX_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_XLSX_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Built-in number formats that display a date/time
+_XLSX_DATE_FORMAT_IDS = frozenset(range(14, 23)) | frozenset({45, 46, 47})
+# Custom format codes are dates if they use date/time tokens outside quoted
+# literals and [colour]/[$-locale] sections
+_RE_XLSX_FORMAT_LITERALS = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+_RE_XLSX_DATE_TOKENS = re.compile(r'[dmyhs]', re.IGNORECASE)
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+def _xlsx_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    try:
+        part = archive.open("xl/sharedStrings.xml")
+    except KeyError:
+        return []
+    strings = []
+    with part:
+        for _, elem in ET.iterparse(part):
+            if elem.tag == _XLSX_MAIN + "si":
+                # Rich text is split over runs; phonetic hints (rPh) aren't content
+                runs = elem.findall(_XLSX_MAIN + "t") or elem.findall(f"{_XLSX_MAIN}r/{_XLSX_MAIN}t")
+                strings.append("".join(t.text or "" for t in runs))
+                elem.clear()
+    return strings
+
+def _xlsx_first_sheet_path(archive: zipfile.ZipFile) -> str:
+    workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+    sheet = workbook.find(f"{_XLSX_MAIN}sheets/{_XLSX_MAIN}sheet")
+    rel_id = sheet.get(_XLSX_REL + "id")
+    rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels.iter(_XLSX_PKG_REL + "Relationship"):
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            return target.lstrip("/") if target.startswith("/") else "xl/" + target
+    raise KeyError(f"Sheet relationship {rel_id} not found")
+
+def _xlsx_date_styles(archive: zipfile.ZipFile) -> List[bool]:
+    """For each cell style index, whether its number format shows a date."""
+    try:
+        styles = ET.fromstring(archive.read("xl/styles.xml"))
+    except KeyError:
+        return []
+    custom_dates = set()
+    for fmt in styles.iter(_XLSX_MAIN + "numFmt"):
+        code = _RE_XLSX_FORMAT_LITERALS.sub("", fmt.get("formatCode", ""))
+        if _RE_XLSX_DATE_TOKENS.search(code):
+            custom_dates.add(int(fmt.get("numFmtId")))
+    cell_xfs = styles.find(_XLSX_MAIN + "cellXfs")
+    if cell_xfs is None:
+        return []
+    return [
+        int(xf.get("numFmtId", 0)) in _XLSX_DATE_FORMAT_IDS or int(xf.get("numFmtId", 0)) in custom_dates
+        for xf in cell_xfs.findall(_XLSX_MAIN + "xf")
+    ]
+
+def _xlsx_cell_text(cell, shared: List[str], date_styles: List[bool]) -> str:
+    kind = cell.get("t")
+    if kind == "inlineStr":
+        return "".join(t.text or "" for t in cell.iter(_XLSX_MAIN + "t"))
+    # Formulas without a cached result have no (or an empty) value
+    value = cell.findtext(_XLSX_MAIN + "v")
+    if not value:
+        return ""
+    if kind == "s":
+        return shared[int(value)]
+    if kind == "b":
+        return "True" if value == "1" else "False"
+    if kind in ("str", "e"):
+        return value
+    # Numeric; dates are serial day counts in a date-formatted style
+    style = int(cell.get("s", 0))
+    if style < len(date_styles) and date_styles[style]:
+        # Rounded to the millisecond, as serials carry float noise below that
+        return str(_EXCEL_EPOCH + timedelta(milliseconds=round(float(value) * 86_400_000)))
+    # Same int/float split as openpyxl
+    if "." in value or "E" in value.upper():
+        return str(float(value))
+    return str(int(value))
+
+def _iter_xlsx_rows(file_path: Path) -> Iterator[List[str]]:
+    """
+    Yield the first sheet's rows as cell texts, parsing the workbook's XML
+    parts directly: no openpyxl cell objects, and the sheet is streamed with
+    iterparse so only one row is in memory at a time.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        shared = _xlsx_shared_strings(archive)
+        date_styles = _xlsx_date_styles(archive)
+        with archive.open(_xlsx_first_sheet_path(archive)) as sheet:
+            for _, elem in ET.iterparse(sheet):
+                if elem.tag == _XLSX_MAIN + "row":
+                    yield [_xlsx_cell_text(cell, shared, date_styles) for cell in elem.iter(_XLSX_MAIN + "c")]
+                    elem.clear()
+
+# PDFium is not thread-safe; calls from worker threads in one process take turns
+_pdfium_lock = threading.Lock()
+
+def _pdf_page_count(file_path: str) -> int:
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def _extract_pdf_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """
+    Text of pages [start, stop) of a PDF. Module-level so process pool
+    workers can run it; each opens the file itself rather than receiving it.
+    """
+    if pdfium is not None:
+        # Given a path, PDFium reads the file itself, so no copy of it is
+        # ever made in Python
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(file_path)
+            try:
+                texts = []
+                for i in range(start, stop):
+                    page = pdf[i]
+                    textpage = page.get_textpage()
+                    texts.append(textpage.get_text_range().replace("\r\n", "\n"))
+                    textpage.close()
+                    page.close()
+                return texts
+            finally:
+                pdf.close()
+
+    with open(file_path, 'rb') as f:
+        reader = pypdf.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
 class DocumentProcessor:
     def __init__(self, upload_dir: str = "uploads"):
         self.upload_dir = Path(upload_dir)
@@ -32,6 +297,11 @@ class DocumentProcessor:
         """
         Process a file and return a list of document chunks.
         """
+        # Parsing is blocking CPU/disk work; run it off the event loop so
+        # concurrent callers actually overlap
+        return await asyncio.to_thread(self._process_file_sync, file_path, metadata)
+
+    def _process_file_sync(self, file_path: str, metadata: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         file_path = Path(file_path)
         if not file_path.exists():
             raise FileNotFoundError(f"File {file_path} not found")
@@ -42,7 +312,7 @@ class DocumentProcessor:
         try:
             if ext == '.pdf':
                 content = self._process_pdf(file_path)
-            elif ext in ['.csv', '.xlsx', '.xls']:
+            elif ext in SPREADSHEET_EXTENSIONS:
                 content = self._process_spreadsheet(file_path)
             elif ext == '.txt':
                 content = self._process_txt(file_path)
@@ -68,36 +338,77 @@ class DocumentProcessor:
             return documents
             
         except Exception as e:
-            logger.error(f"Error processing file {file_path}: {e}")
+            logger.error("Error processing file %s: %s", file_path, e)
             raise
 
     def _process_pdf(self, file_path: Path) -> str:
+        if pdfium is not None:
+            page_count = _pdf_page_count(str(file_path))
+            if page_count >= PDF_PARALLEL_MIN_PAGES and not _in_pool_worker:
+                return self._process_pdf_parallel(file_path, page_count)
+            return _join_pages(_extract_pdf_pages(str(file_path), 0, page_count))
+
         if not pypdf:
-            raise ImportError("pypdf is required for PDF processing")
+            raise ImportError("pypdf or pypdfium2 is required for PDF processing")
         
-        text = ""
+        pages = []
         with open(file_path, 'rb') as f:
             reader = pypdf.PdfReader(f)
+            page_count = len(reader.pages)
+            if page_count >= PDF_PARALLEL_MIN_PAGES and not _in_pool_worker:
+                return self._process_pdf_parallel(file_path, page_count)
             for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + "\n"
-        return text
+                pages.append(page.extract_text())
+        return _join_pages(pages)
+
+    def _process_pdf_parallel(self, file_path: Path, page_count: int) -> str:
+        """Extract page ranges on the process pool; page text extraction is CPU-bound and holds the GIL."""
+        starts = range(0, page_count, PDF_PAGES_PER_TASK)
+        stops = [min(start + PDF_PAGES_PER_TASK, page_count) for start in starts]
+        # map() yields in submission order, so pages come back in order
+        results = _get_process_pool().map(_extract_pdf_pages, [str(file_path)] * len(stops), starts, stops)
+        return _join_pages([page for pages in results for page in pages])
 
     def _process_spreadsheet(self, file_path: Path) -> str:
+        ext = file_path.suffix.lower()
+        # CSV and XLSX rows are streamed straight into text lines, so no
+        # DataFrame (and no to_string copy of it) is ever built
+        if ext == '.csv':
+            with open(file_path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+                return self._rows_to_text(csv.reader(f))
+        if ext in OPENPYXL_EXTENSIONS:
+            # Only the text is wanted, so read the sheet XML directly; openpyxl
+            # is the fallback for workbooks this simple reader can't handle
+            try:
+                return self._rows_to_text(_iter_xlsx_rows(file_path))
+            except (KeyError, ValueError, IndexError, ET.ParseError, zipfile.BadZipFile) as e:
+                logger.warning("Direct XLSX read of %s failed (%s), using openpyxl", file_path, e)
+            if not openpyxl:
+                raise ImportError("openpyxl is required for Excel processing")
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                # First sheet, as pd.read_excel reads by default
+                return self._rows_to_text(workbook.worksheets[0].iter_rows(values_only=True))
+            finally:
+                workbook.close()
+        
+        # Legacy .xls needs pandas' xlrd engine
         if not pd:
             raise ImportError("pandas is required for spreadsheet processing")
-            
-        if file_path.suffix == '.csv':
-            df = pd.read_csv(file_path)
-        else:
-            if not openpyxl and file_path.suffix in ['.xlsx', '.xlsm']:
-                 raise ImportError("openpyxl is required for Excel processing")
-            df = pd.read_excel(file_path)
-            
-        # Convert to string representation
+        df = pd.read_excel(file_path)
         return df.to_string(index=False)
 
+    @staticmethod
+    def _rows_to_text(rows) -> str:
+        """One line per non-empty row, cells separated by spaces (header row first)."""
+        lines = []
+        for row in rows:
+            cells = ["" if cell is None else str(cell).strip() for cell in row]
+            line = " ".join(cell for cell in cells if cell)
+            if line:
+                lines.append(line)
+        return "\n".join(lines)
+
     def _process_txt(self, file_path: Path) -> str:
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
             return f.read()
@@ -110,39 +421,44 @@ class DocumentProcessor:
         if not text:
             return []
             
-        # normalize whitespace but keep newlines for paragraph detection
-        text = re.sub(r'[ \t]+', ' ', text)
-        
-        # Split by double newlines (paragraphs)
-        paragraphs = re.split(r'\n\s*\n', text)
-        
+        # Split by double newlines (paragraphs). Runs of spaces/tabs never
+        # decide a paragraph break, so whitespace is normalized per paragraph
+        # below rather than in a full copy of the text first. Paragraphs are
+        # sliced off one at a time, so only the current one is copied
         chunks = []
         current_chunk = []
         current_length = 0
         
-        for para in paragraphs:
+        for para in _iter_paragraphs(text):
             para = para.strip()
             if not para:
                 continue
+            # normalize whitespace but keep newlines
+            para = _RE_WS.sub(' ', para)
                 
             # If paragraph itself is too large, split it by sentences
             if len(para) > chunk_size:
                 # Process large paragraph
-                sentences = re.split(r'(?<=[.!?])\s+', para)
+                sentences = []
+                for sentence in _split_sentences(para):
+                    if len(sentence) > chunk_size:
+                        sentences.extend(_split_long(sentence, chunk_size))
+                    else:
+                        sentences.append(sentence)
                 for sentence in sentences:
                     if current_length + len(sentence) > chunk_size and current_chunk:
                         chunks.append(' '.join(current_chunk))
                         
-                        # Overlap
-                        overlap_text = ""
+                        # Overlap: the longest run of trailing pieces that fits,
+                        # found by index and joined once
+                        keep = len(current_chunk)
                         overlap_len = 0
-                        for i in range(len(current_chunk)-1, -1, -1):
-                            if overlap_len + len(current_chunk[i]) > overlap:
-                                break
-                            overlap_text = current_chunk[i] + " " + overlap_text
-                            overlap_len += len(current_chunk[i])
+                        while keep > 0 and overlap_len + len(current_chunk[keep - 1]) <= overlap:
+                            keep -= 1
+                            overlap_len += len(current_chunk[keep])
+                        overlap_text = ' '.join(current_chunk[keep:]).strip()
                             
-                        current_chunk = [overlap_text.strip()] if overlap_text.strip() else []
+                        current_chunk = [overlap_text] if overlap_text else []
                         current_length = len(current_chunk[0]) if current_chunk else 0
                         
                     current_chunk.append(sentence)
@@ -166,22 +482,24 @@ class DocumentProcessor:
         if current_chunk:
             chunks.append(' '.join(current_chunk))
             
-        return chunks if chunks else [text]  # Fallback to full text if no chunks created
+        return chunks if chunks else [_RE_WS.sub(' ', text)]  # Fallback to full text if no chunks created
     
     async def process_files_batch(self, file_paths: List[str], metadata_list: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         Process multiple files in parallel for better performance.
         """
-        import asyncio
-        
         if metadata_list is None:
             metadata_list = [None] * len(file_paths)
         elif len(metadata_list) != len(file_paths):
             raise ValueError("metadata_list must have same length as file_paths")
         
-        # Create tasks for parallel processing
+        # Parsing holds the GIL, so threads would take turns; each file goes
+        # to the process pool instead (the processor itself is just a path
+        # and pickles cheaply)
+        loop = asyncio.get_running_loop()
+        pool = _get_process_pool()
         tasks = [
-            self.process_file(file_path, metadata) 
+            loop.run_in_executor(pool, self._process_file_sync, file_path, metadata)
             for file_path, metadata in zip(file_paths, metadata_list)
         ]
         
@@ -192,7 +510,7 @@ class DocumentProcessor:
         all_documents = []
         for i, result in enumerate(results):
             if isinstance(result, Exception):
-                logger.error(f"Error processing file {file_paths[i]}: {result}")
+                logger.error("Error processing file %s: %s", file_paths[i], result)
                 continue
             all_documents.extend(result)
         
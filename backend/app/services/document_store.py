@@ -0,0 +1,136 @@
+import os
+import logging
+from pathlib import Path
+from typing import List, Dict, Set
+
+from app import json_utils
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Fold the append log into the snapshot once it outgrows it (and is at least this big)
+COMPACT_MIN_BYTES = 1024 * 1024
+
+class DocumentStore:
+    """
+    Persists processed document chunks for the RAG service.
+
+    documents.json is a compacted snapshot; each upload batch is appended to
+    documents.jsonl, so saving costs O(new chunks) instead of a full rewrite.
+    A {"replaced_source": name} line drops every earlier chunk from that source.
+    """
+    def __init__(self, persist_dir: str = "chroma_db"):
+        self.persist_dir = Path(persist_dir)
+        self.snapshot_file = self.persist_dir / "documents.json"
+        self.log_file = self.persist_dir / "documents.jsonl"
+        # Sorted list of indexed source filenames, so listing uploads doesn't parse every chunk
+        self.sources_file = self.persist_dir / "sources.json"
+
+    def append(self, documents: List[Dict]) -> None:
+        """Append a batch of chunks, replacing any earlier chunks from the same sources."""
+        if not documents:
+            return
+
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        sources = dict.fromkeys(doc['source'] for doc in documents)
+        lines = [json_utils.dumps({"replaced_source": source}) for source in sources]
+        lines.extend(json_utils.dumps(doc) for doc in documents)
+
+        # Single O_APPEND write so a batch lands as one unit
+        with open(self.log_file, 'ab') as f:
+            f.write(b"\n".join(lines) + b"\n")
+
+        self._write_sources(self.sources().union(sources))
+        self._maybe_compact()
+
+    def load(self) -> List[Dict]:
+        """Return the current document set (snapshot with the append log applied)."""
+        documents = self._load_snapshot()
+
+        try:
+            with open(self.log_file, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json_utils.loads(line)
+                    except json_utils.JSONDecodeError:
+                        logger.warning("Skipping corrupt line in %s", self.log_file)
+                        continue
+                    replaced = record.get("replaced_source")
+                    if replaced is not None:
+                        documents = [doc for doc in documents if doc.get('source') != replaced]
+                    else:
+                        documents.append(record)
+        except FileNotFoundError:
+            pass
+
+        return documents
+
+    def sources(self) -> Set[str]:
+        """Return the set of source filenames that have indexed chunks."""
+        try:
+            with open(self.sources_file, 'rb') as f:
+                return set(json_utils.loads(f.read()))
+        except FileNotFoundError:
+            pass
+        except json_utils.JSONDecodeError:
+            logger.warning("Rebuilding corrupt %s", self.sources_file)
+
+        sources = self._collect_sources(self.load())
+        if sources:
+            self._write_sources(sources)
+        return sources
+
+    def write_snapshot(self, documents: List[Dict]) -> None:
+        """Replace all stored documents with a fresh snapshot and drop the append log."""
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.snapshot_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'wb') as f:
+            f.write(json_utils.dumps(documents, indent=settings.pretty_json_state))
+        os.replace(tmp_file, self.snapshot_file)
+        try:
+            os.remove(self.log_file)
+        except FileNotFoundError:
+            pass
+        self._write_sources(self._collect_sources(documents))
+
+    def compact(self) -> int:
+        """Fold the append log into documents.json. Returns the document count."""
+        documents = self.load()
+        self.write_snapshot(documents)
+        logger.info("Compacted %s documents into %s", len(documents), self.snapshot_file)
+        return len(documents)
+
+    @staticmethod
+    def _collect_sources(documents: List[Dict]) -> Set[str]:
+        return set(doc['source'] for doc in documents if doc.get('source'))
+
+    def _write_sources(self, sources: Set[str]) -> None:
+        tmp_file = self.sources_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'wb') as f:
+            f.write(json_utils.dumps(sorted(sources)))
+        os.replace(tmp_file, self.sources_file)
+
+    def _maybe_compact(self) -> None:
+        try:
+            log_size = self.log_file.stat().st_size
+        except FileNotFoundError:
+            return
+        try:
+            snapshot_size = self.snapshot_file.stat().st_size
+        except FileNotFoundError:
+            snapshot_size = 0
+        if log_size > max(snapshot_size, COMPACT_MIN_BYTES):
+            self.compact()
+
+    def _load_snapshot(self) -> List[Dict]:
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                data = json_utils.loads(f.read())
+                return data if isinstance(data, list) else []
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error("Error loading documents from %s: %s", self.snapshot_file, e)
+            return []
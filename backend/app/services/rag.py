@@ -4,17 +4,18 @@ import time
 from pathlib import Path
 from datetime import datetime
 import numpy as np
-from collections import defaultdict
-import json
+from collections import OrderedDict, defaultdict
 import re
 import asyncio
 import hashlib
+import threading
 import pickle
 from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
 
 # Import conversation memory
 from app.services.conversation_memory import ConversationMemory
+from app.services.document_store import DocumentStore
+from app import json_utils
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,6 +27,14 @@ logger = logging.getLogger(__name__)
 
 # Import FAISS Vector Store
 from app.services.vector_store import FAISSVectorStore
+from app.services import bm25_numba
+
+# Rank this many candidates per requested result before the per-source
+# diversity filter; the full ranking is only computed if they run out
+DIVERSITY_OVERSAMPLE = 4
+
+# Recent retrieval results kept per HybridRetriever, keyed by normalized query
+RETRIEVAL_CACHE_SIZE = 512
 
 class KnowledgeRetriever:
     """
@@ -37,17 +46,13 @@ class KnowledgeRetriever:
         
     def _load(self, path: str) -> Dict:
         try:
-            # Handle relative paths from backend root
-            if not os.path.exists(path):
-                # Try finding it relative to current working dir
-                path = os.path.join(os.getcwd(), path)
-                
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            # Relative paths resolve against the current working dir
+            with open(path, 'rb') as f:
+                return json_utils.loads(f.read())
+        except FileNotFoundError:
             return {}
         except Exception as e:
-            logger.error(f"Failed to load knowledge graph: {e}")
+            logger.error("Failed to load knowledge graph: %s", e)
             return {}
 
     def search(self, query: str) -> Optional[str]:
@@ -89,23 +94,34 @@ class HybridRetriever:
         """
         # Initialize FAISS Vector Store
         self.vector_store = FAISSVectorStore(model_name=model_name)
-        self.bm25 = None
+        self.bm25_scorer: Optional[bm25_numba.BM25Scorer] = None
         self.documents = []
-        logger.info(f"Initialized HybridRetriever with {model_name} and FAISS")
+        self._key_to_indices: Dict[str, List[int]] = {}
+        # Bumped each time a new index is published; part of the cache key
+        self._index_version = 0
+        # LRU of retrieve() results; cleared whenever the index changes
+        self._retrieval_cache: "OrderedDict[Tuple[int, str, int, float, float], List[Dict]]" = OrderedDict()
+        # retrieve() runs both on the event loop and in prefetch threads.
+        # _lock guards the cache and swapping in a new index (documents,
+        # scorer and prefix map together); _update_lock serializes updates
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        logger.info("Initialized HybridRetriever with %s and FAISS", model_name)
     
     def index_documents(self, documents: List[Dict]) -> None:
         """
         Index documents using both BM25 and FAISS.
         """
-        self.documents = documents
-        logger.info(f"Indexing {len(documents)} documents...")
+        logger.info("Indexing %s documents...", len(documents))
         
         # Build BM25 index
         tokenized_docs = [
             doc['text'].lower().split() 
             for doc in documents
         ]
-        self.bm25 = BM25Okapi(tokenized_docs)
+        # Queries walk only their terms' postings instead of every document
+        with self._update_lock:
+            self._publish(documents, bm25_numba.BM25Scorer().with_documents(tokenized_docs))
         
         # Add to FAISS Vector Store
         # Check if already indexed to avoid duplicates/re-indexing cost
@@ -123,7 +139,63 @@ class HybridRetriever:
             else:
                  logger.info("Vector store already populated. Skipping re-embedding for speed.")
         
-        logger.info(f"Indexed documents. FAISS contains {len(self.vector_store.documents)} docs.")
+        logger.info("Indexed documents. FAISS contains %s docs.", len(self.vector_store.documents))
+    
+    def add_documents(self, documents: List[Dict]) -> None:
+        """
+        Add newly processed chunks without re-indexing the existing ones.
+        As in DocumentStore.append, chunks from an already indexed source
+        replace that source's earlier chunks. Only the new chunks are
+        tokenized and embedded; the replaced chunks' vectors are dropped
+        from FAISS without re-embedding the rest.
+        """
+        if not documents:
+            return
+        documents = list(documents)
+        sources = {doc.get('source') for doc in documents}
+        
+        with self._update_lock:
+            current = self.documents
+            scorer = self.bm25_scorer or bm25_numba.BM25Scorer()
+            keep = np.fromiter((doc.get('source') not in sources for doc in current), dtype=bool, count=len(current))
+            if not keep.all():
+                scorer = scorer.without_documents(keep)
+                current = [doc for doc, kept in zip(current, keep) if kept]
+            scorer = scorer.with_documents([doc['text'].lower().split() for doc in documents])
+            self._publish(current + documents, scorer)
+            
+            self.vector_store.remove_sources(sources)
+            self.vector_store.add_documents(documents)
+        logger.info("Added %s documents to the index (%s in total)", len(documents), len(self.documents))
+    
+    def _publish(self, documents: List[Dict], scorer: "bm25_numba.BM25Scorer") -> None:
+        """Swap in a new index and drop results cached against the old one."""
+        # Map the 50-char text prefix used to match FAISS hits back to positions here
+        key_to_indices = defaultdict(list)
+        for i, doc in enumerate(documents):
+            key_to_indices[doc['text'][:50]].append(i)
+        
+        with self._lock:
+            self.documents = documents
+            self.bm25_scorer = scorer
+            self._key_to_indices = key_to_indices
+            self._index_version += 1
+            self._retrieval_cache.clear()
+    
+    def activate_numba_scorer(self) -> bool:
+        """
+        Compile the Numba kernels in bm25_numba up front so the first query
+        doesn't pay for JIT. Returns False if numba is missing, in which case
+        scoring uses their numpy equivalents.
+        """
+        if not bm25_numba.NUMBA_AVAILABLE:
+            logger.info("numba not installed; using numpy BM25 scoring")
+            return False
+        
+        start = time.time()
+        bm25_numba.warmup()
+        logger.info("Numba BM25 scorer ready in %.2fs", time.time() - start)
+        return True
     
     def _normalize_scores(self, scores: np.ndarray) -> np.ndarray:
         """Min-max normalization to [0, 1]"""
@@ -149,13 +221,31 @@ class HybridRetriever:
         Hybrid retrieval combining BM25 and semantic similarity.
         """
         
-        if not self.bm25:
+        # One consistent view of the index, even if an update lands meanwhile
+        with self._lock:
+            documents = self.documents
+            scorer = self.bm25_scorer
+            key_to_indices = self._key_to_indices
+            version = self._index_version
+        
+        if scorer is None:
              logger.warning("BM25 not initialized. Returning empty.")
              return []
         
+        # BM25 tokenizes the lowercased query on whitespace and the embedding
+        # model is uncased, so queries differing only in case/spacing share results
+        cache_key = (version, " ".join(query.lower().split()), k, bm25_weight, semantic_weight)
+        with self._lock:
+            cached = self._retrieval_cache.get(cache_key)
+            if cached is not None:
+                self._retrieval_cache.move_to_end(cache_key)
+                logger.info("Retrieval cache hit for query: '%s'", query)
+                return list(cached)
+        
         # 1. BM25 Retrieval
         # Get all scores, then we'll map them
-        bm25_scores = self.bm25.get_scores(query.lower().split())
+        query_tokens = query.lower().split()
+        bm25_scores = scorer.get_scores(query_tokens)
         
         # 2. Semantic Retrieval (FAISS)
         # FAISS returns top k. To do proper hybrid fusion, we ideally need scores for ALL docs
@@ -172,44 +262,57 @@ class HybridRetriever:
         # if loaded from disk vs passed in.
         # Let's rely on the text being the key for mapping scores.
         
-        semantic_score_map = {}
+        # Scatter semantic scores onto document positions, then fuse both
+        # score vectors in one numpy pass instead of a per-document Python loop
+        semantic_scores = np.zeros(len(documents), dtype=np.float64)
         for doc, score in semantic_results:
             # key: first 50 chars of text as simplistic ID
-            key = doc.get('text', '')[:50] 
-            semantic_score_map[key] = score
+            for i in key_to_indices.get(doc.get('text', '')[:50], ()):
+                semantic_scores[i] = score
 
-        # Combine scores
-        final_results = []
-        for i, doc in enumerate(self.documents):
-            key = doc['text'][:50]
-            
-            s_score = semantic_score_map.get(key, 0.0) # 0 if not in top k of semantic
-            b_score = bm25_scores[i]
-            
-            # Normalize scores roughly? BM25 is unbounded.
-            # Let's just normalize BM25 relative to the batch if possible, 
-            # or just assume standard ranges.
-            # A simple normalization for BM25 in this context:
-            
-            final_score = (bm25_weight * b_score) + (semantic_weight * s_score * 10) # boosting semantic a bit
-            
-            final_results.append({
-                'document': doc,
-                'hybrid_score': final_score,
-                'bm25_score': b_score,
-                'semantic_score': s_score
-            })
-            
-        # Sort by hybrid score
-        final_results.sort(key=lambda x: x['hybrid_score'], reverse=True)
+        # Normalize scores roughly? BM25 is unbounded.
+        # Let's just normalize BM25 relative to the batch if possible, 
+        # or just assume standard ranges.
+        hybrid_scores = (bm25_weight * np.asarray(bm25_scores)) + (semantic_weight * semantic_scores * 10) # boosting semantic a bit
         
-        # Apply diversity filtering: max 2 chunks per document
+        # Rank only the top candidates (stable, so ties keep document order).
+        # _diversify walks them in order and stops at k, so a prefix of the
+        # ranking gives the same result as the full one whenever it suffices
+        n_candidates = min(len(hybrid_scores), k * DIVERSITY_OVERSAMPLE)
+        while True:
+            order = bm25_numba.topk(hybrid_scores, n_candidates)
+            diverse_results, seen_documents = self._diversify(documents, order, k, hybrid_scores, bm25_scores, semantic_scores)
+            if len(diverse_results) >= k or n_candidates >= len(hybrid_scores):
+                break
+            # Candidates were dominated by a few sources; widen the window
+            # rather than ranking every document
+            n_candidates = min(len(hybrid_scores), n_candidates * DIVERSITY_OVERSAMPLE)
+
+        logger.info("Retrieved %s diverse documents from %s unique sources", len(diverse_results), len(seen_documents))
+        with self._lock:
+            if version == self._index_version:
+                self._retrieval_cache[cache_key] = diverse_results
+            if len(self._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+                self._retrieval_cache.popitem(last=False)
+        return list(diverse_results)
+    
+    def _diversify(
+        self,
+        documents: List[Dict],
+        order: np.ndarray,
+        k: int,
+        hybrid_scores: np.ndarray,
+        bm25_scores: np.ndarray,
+        semantic_scores: np.ndarray
+    ) -> Tuple[List[Dict], Dict[str, int]]:
+        """Walk ranked positions keeping at most 2 chunks per source, up to k results."""
         seen_documents = {}
         diverse_results = []
 
-        for result in final_results:
+        for i in order:
+            doc = documents[i]
             # Extract document source/name from result
-            doc_source = result.get('document', {}).get('source') or result.get('document', {}).get('metadata', {}).get('filename') or 'unknown'
+            doc_source = doc.get('source') or doc.get('metadata', {}).get('filename') or 'unknown'
             
             # Track how many chunks we've taken from this document
             if doc_source not in seen_documents:
@@ -217,15 +320,19 @@ class HybridRetriever:
             
             # Only allow max 2 chunks per document
             if seen_documents[doc_source] < 2:
-                diverse_results.append(result)
+                diverse_results.append({
+                    'document': doc,
+                    'hybrid_score': float(hybrid_scores[i]),
+                    'bm25_score': float(bm25_scores[i]),
+                    'semantic_score': float(semantic_scores[i])
+                })
                 seen_documents[doc_source] += 1
                 
                 # Stop when we have enough diverse results
                 if len(diverse_results) >= k:
                     break
 
-        logger.info(f"Retrieved {len(diverse_results)} diverse documents from {len(seen_documents)} unique sources")
-        return diverse_results
+        return diverse_results, seen_documents
         
 
 
@@ -256,6 +363,10 @@ class QueryExpander:
         if len(self.session_history[session_id]) > 5:
             self.session_history[session_id].pop(0)
     
+    def forget_session(self, session_id: str) -> None:
+        """Drop a finished session's query history"""
+        self.session_history.pop(session_id, None)
+    
     def _should_expand(self, query: str, history: List[str]) -> bool:
         """
         Heuristic: expand if query is short AND history exists
@@ -309,11 +420,11 @@ Rules:
             )
             expanded = response.choices[0].message.content.strip()
             
-            logger.info(f"Query expansion: '{query}' -> '{expanded}'")
+            logger.info("Query expansion: '%s' -> '%s'", query, expanded)
             return expanded, True
             
         except Exception as e:
-            logger.warning(f"Query expansion failed: {e}. Using original query.")
+            logger.warning("Query expansion failed: %s. Using original query.", e)
             return query, False
 
 
@@ -463,7 +574,7 @@ class ResponseCache:
         self.cache = {}  # {query_hash: (answer, timestamp, original_query)}
         self.max_size = max_size
         self.ttl_seconds = ttl_seconds
-        logger.info(f"ResponseCache initialized (max_size={max_size}, ttl={ttl_seconds}s)")
+        logger.info("ResponseCache initialized (max_size=%s, ttl=%ss)", max_size, ttl_seconds)
     
     def _hash_query(self, query: str) -> str:
         """Normalize and hash query for cache key"""
@@ -488,14 +599,14 @@ class ResponseCache:
             
             # Check if cache entry is still valid
             if time.time() - timestamp < self.ttl_seconds:
-                logger.info(f"Cache HIT for query: '{query}' (cached: '{original_query}')")
+                logger.info("Cache HIT for query: '%s' (cached: '%s')", query, original_query)
                 return answer
             else:
                 # Expired, remove from cache
-                logger.info(f"Cache EXPIRED for query: '{query}'")
+                logger.info("Cache EXPIRED for query: '%s'", query)
                 del self.cache[query_hash]
         
-        logger.info(f"Cache MISS for query: '{query}'")
+        logger.info("Cache MISS for query: '%s'", query)
         return None
     
     def set(self, query: str, answer: str) -> None:
@@ -515,11 +626,11 @@ class ResponseCache:
                 self.cache.items(), 
                 key=lambda x: x[1][1]  # Sort by timestamp
             )[0]
-            logger.info(f"Cache FULL, evicting oldest entry")
+            logger.info("Cache FULL, evicting oldest entry")
             del self.cache[oldest_hash]
         
         self.cache[query_hash] = (answer, time.time(), query)
-        logger.info(f"Cache SET for query: '{query}' (cache size: {len(self.cache)})")
+        logger.info("Cache SET for query: '%s' (cache size: %s)", query, len(self.cache))
     
     def clear(self) -> None:
         """Clear all cached responses"""
@@ -535,10 +646,144 @@ class ResponseCache:
         }
 
 
+class SemanticResponseCache:
+    """
+    Approximate response cache keyed by query embedding.
+    Paraphrased questions ("What are the fees?" / "fees?") hit when the cosine
+    similarity of their embeddings clears the threshold. An exact-match dict
+    sits in front so byte-identical repeats skip the embedding entirely.
+    Entries expire after ttl_seconds, like ResponseCache's.
+    """
+    
+    # Embedding rows allocated on first insert
+    INITIAL_ROWS = 64
+    
+    def __init__(self, embed_fn, max_size: int = 4096, threshold: float = 0.92, ttl_seconds: int = 3600):
+        """
+        Args:
+            embed_fn: Callable returning an L2-normalized float32 vector (or None) for a query
+            max_size: Maximum number of cached responses (FIFO eviction)
+            threshold: Minimum cosine similarity for a semantic hit
+            ttl_seconds: Time-to-live for cached responses (default: 1 hour)
+        """
+        self.embed_fn = embed_fn
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.matrix = None  # (rows, dim) float32, allocated on first insert and doubled up to max_size
+        self.answers: List[Optional[str]] = [None] * max_size
+        self.keys: List[Optional[str]] = [None] * max_size
+        self.added_at = np.zeros(max_size, dtype=np.float64)  # time.monotonic() per slot
+        self.exact: Dict[str, int] = {}  # normalized query -> slot
+        self.count = 0
+        self.next_slot = 0
+        # lookup() runs in worker threads while add() runs on the event loop;
+        # the lock keeps a matched row and its answer from the same slot
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+    
+    @staticmethod
+    def is_cacheable(query: str) -> bool:
+        """Queries carrying numbers (ranks, years) embed almost identically but need distinct answers."""
+        return not any(ch.isdigit() for ch in query)
+    
+    def lookup(self, query: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Return (cached answer or None, query vector). The vector is reused by add()
+        so a miss doesn't pay for a second embedding.
+        """
+        key = self._normalize(query)
+        with self._lock:
+            slot = self.exact.get(key)
+            if slot is not None and time.monotonic() - self.added_at[slot] < self.ttl_seconds:
+                return self.answers[slot], None
+        if not self.is_cacheable(query):
+            return None, None
+        
+        vector = self.embed_fn(query)
+        if vector is None:
+            return None, vector
+        
+        with self._lock:
+            if self.count == 0:
+                return None, vector
+            # Single GEMV over the populated rows, with expired ones ruled out
+            scores = self.matrix[:self.count] @ vector
+            scores[self.added_at[:self.count] <= time.monotonic() - self.ttl_seconds] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                logger.info("Semantic cache HIT for '%s' (matched '%s', score=%.3f)", query, self.keys[best], scores[best])
+                return self.answers[best], vector
+        return None, vector
+    
+    def add(self, query: str, answer: str, vector: Optional[np.ndarray] = None) -> None:
+        """Cache an answer, embedding the query if no vector was passed in."""
+        if not self.is_cacheable(query):
+            return
+        key = self._normalize(query)
+        if self._is_fresh(key):
+            return
+        if vector is None:
+            vector = self.embed_fn(query)
+            if vector is None:
+                return
+        
+        with self._lock:
+            self._insert(key, answer, vector)
+    
+    def _is_fresh(self, key: str) -> bool:
+        with self._lock:
+            slot = self.exact.get(key)
+            return slot is not None and time.monotonic() - self.added_at[slot] < self.ttl_seconds
+    
+    def _insert(self, key: str, answer: str, vector: np.ndarray) -> None:
+        """Write one entry into the next ring slot (caller holds the lock)."""
+        slot = self.next_slot
+        if self.matrix is None:
+            self.matrix = np.empty((min(self.INITIAL_ROWS, self.max_size), vector.shape[0]), dtype=np.float32)
+        elif slot == self.matrix.shape[0]:
+            # Full but below max_size: double the rows (the ring only wraps at max_size)
+            grown = np.empty((min(slot * 2, self.max_size), self.matrix.shape[1]), dtype=np.float32)
+            grown[:slot] = self.matrix
+            self.matrix = grown
+        
+        old_key = self.keys[slot]
+        if old_key is not None and self.exact.get(old_key) == slot:
+            del self.exact[old_key]
+        
+        self.matrix[slot] = vector
+        self.answers[slot] = answer
+        self.keys[slot] = key
+        self.added_at[slot] = time.monotonic()
+        self.exact[key] = slot
+        self.next_slot = (slot + 1) % self.max_size
+        self.count = min(self.count + 1, self.max_size)
+    
+    def clear(self) -> None:
+        """Clear all cached responses"""
+        with self._lock:
+            self.matrix = None
+            self.answers = [None] * self.max_size
+            self.keys = [None] * self.max_size
+            self.added_at[:] = 0
+            self.exact.clear()
+            self.count = 0
+            self.next_slot = 0
+
+
 # ============================================================================
 # 6. MAIN RAG SERVICE - Integration of All Components
 # ============================================================================
 
+# Patterns for the no-LLM fallback answers and profile extraction in
+# query_stream, compiled once at import instead of on every turn
+_RE_HOD = re.compile(r'(HOD|Head.*?)([A-Z][a-z]+\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)')
+_RE_FEE = re.compile(r'(fee|cost|tuition|\₹\d+,?\d*)\s*(?:per semester|per year|total)?\s*(\₹\d+,?\d*|\d+,?\d+)', re.IGNORECASE)
+_RE_RANK = re.compile(r'(\d+)')
+
 class RAGService:
     """
     Main RAG service integrating hybrid retrieval, query expansion, analytics, and caching.
@@ -570,27 +815,28 @@ class RAGService:
         # Load documents from JSON file
         self.documents = self._load_documents()
         
+        # JIT-compile the BM25 kernels at startup rather than on the first query
+        self.hybrid_retriever.activate_numba_scorer()
+        
         # Index documents for retrieval
         if self.documents:
             self.hybrid_retriever.index_documents(self.documents)
         
         self.initialized = True
-        logger.info(f"RAGService initialized with {len(self.documents)} documents")
+        logger.info("RAGService initialized with %s documents", len(self.documents))
     
     def _load_documents(self) -> List[Dict]:
         """Load documents from JSON file"""
         try:
-            storage_file = Path("chroma_db/documents.json")
-            if storage_file.exists():
-                with open(storage_file, 'r', encoding='utf-8') as f:
-                    documents = json.load(f)
-                    logger.info(f"Loaded {len(documents)} documents from {storage_file}")
-                    return documents
+            store = DocumentStore("chroma_db")
+            documents = store.load()
+            if documents:
+                logger.info("Loaded %s documents from %s", len(documents), store.persist_dir)
             else:
-                logger.warning(f"Documents file {storage_file} not found")
-                return []
+                logger.warning("No documents found in %s", store.persist_dir)
+            return documents
         except Exception as e:
-            logger.error(f"Error loading documents: {e}")
+            logger.error("Error loading documents: %s", e)
             return []
     
     def set_clients(self, llm_client, college_config: Dict):
@@ -598,16 +844,86 @@ class RAGService:
         self.query_expander = QueryExpander(llm_client)
         self.system_prompt_builder = SystemPromptBuilder(college_config)
     
+    async def _stream_llm_answer(self, system_prompt: str, query: str, timeout: float) -> AsyncGenerator[str, None]:
+        """
+        Yield the answer text from a streaming Groq completion as it arrives.
+
+        The SDK's stream is a blocking iterator, so it is drained on a worker
+        thread and handed over through a queue. Raises asyncio.TimeoutError
+        once timeout seconds have passed without the stream finishing.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        deadline = loop.time() + timeout
+
+        def _put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # Loop already closed
+
+        def _drain():
+            try:
+                stream = self.query_expander.llm.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": query}
+                    ],
+                    model="llama-3.1-8b-instant",
+                    temperature=0.0,
+                    max_tokens=500,
+                    frequency_penalty=1.0, # Prevent repetition loops
+                    presence_penalty=0.5,
+                    stream=True
+                )
+                for chunk in stream:
+                    if stop.is_set():
+                        break
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        _put(("delta", delta))
+            except Exception as e:
+                _put(("error", e))
+            else:
+                _put(("done", None))
+
+        # Keep a reference: the loop only holds tasks weakly
+        drain_task = asyncio.create_task(asyncio.to_thread(_drain))
+        try:
+            while True:
+                kind, value = await asyncio.wait_for(queue.get(), timeout=max(deadline - loop.time(), 0))
+                if kind == "delta":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    break
+            # The thread has queued its last item and is returning
+            await drain_task
+        finally:
+            # Consumer stopped early or timed out: let the thread drop the
+            # stream, and stop waiting on it (it exits at its next chunk)
+            stop.set()
+            if not drain_task.done():
+                drain_task.cancel()
+
     async def query_stream(self, message: str, session_id: str = None):
         """
         Main query method that integrates all components.
+
+        Yields {"type": "token", "text": ...} for each piece of a freshly
+        generated LLM answer, then a final {"type": "answer", ...} with the
+        complete text (or {"type": "error", ...}).
         """
         start_time = time.time()
-        logger.info(f"Processing query: '{message}' for session: {session_id}")
+        logger.info("Processing query: '%s' for session: %s", message, session_id)
 
         # --- Greeting Check ---
         greetings = ["hello", "hi", "hey", "good morning", "good afternoon", "good evening", "how are you"]
-        normalized_message = message.lower().strip()
+        # Lowercased once here and reused by every keyword check below
+        message_lower = message.lower()
+        normalized_message = message_lower.strip()
         if any(greeting in normalized_message for greeting in greetings) or "can you hear me" in normalized_message:
             logger.info("Greeting detected. Bypassing RAG pipeline.")
             yield {
@@ -621,7 +937,7 @@ class RAGService:
         # --- End Greeting Check ---
 
         # Check if this is a branch query to gather user preferences
-        is_branch_query = any(keyword in message.lower() for keyword in ["branch", "branches", "available", "program", "programs", "cse", "it", "aiml", "ece", "ee", "me", "ce"])
+        is_branch_query = any(keyword in message_lower for keyword in ["branch", "branches", "available", "program", "programs", "cse", "it", "aiml", "ece", "ee", "me", "ce"])
 
         try:
             # Expand query if needed
@@ -632,12 +948,13 @@ class RAGService:
                     )
                     query_to_use = expanded_query if was_expanded else message
                 except Exception as e:
-                    logger.warning(f"Query expansion failed: {e}")
+                    logger.warning("Query expansion failed: %s", e)
                     query_to_use = message
             else:
                 query_to_use = message
             
-            logger.info(f"Using query: {query_to_use}")
+            logger.info("Using query: %s", query_to_use)
+            query_lower = query_to_use.lower()
 
             # 0. Deterministic Knowledge Lookup (Phase 2)
             # Check for exact facts (Fees, Courses) in Knowledge Graph
@@ -657,28 +974,33 @@ class RAGService:
             # Prefetch related queries in background
             try:
                 if hasattr(self, 'query_prefetcher'):
-                    import asyncio
-                    asyncio.create_task(self.query_prefetcher.prefetch_related(query_to_use))
+                    self.query_prefetcher.schedule(query_to_use)
             except Exception as e:
-                logger.warning(f"Error in prefetching: {e}")
+                logger.warning("Error in prefetching: %s", e)
 
             # Retrieve relevant documents
             retrieved_docs = self.hybrid_retriever.retrieve(query_to_use, k=5)
-            logger.info(f"Retrieved {len(retrieved_docs)} documents.")
+            logger.info("Retrieved %s documents.", len(retrieved_docs))
             # --- Added Logging for retrieved docs ---
-            for doc in retrieved_docs:
-                # Try to get source from metadata first, then directly from document
-                source = doc['document'].get('metadata', {}).get('source') or doc['document'].get('source', 'Unknown')
-                logger.info(f"  - Doc: {source}, Score: {doc['hybrid_score']:.4f}")
+            if logger.isEnabledFor(logging.INFO):
+                for doc in retrieved_docs:
+                    # Try to get source from metadata first, then directly from document
+                    source = doc['document'].get('metadata', {}).get('source') or doc['document'].get('source', 'Unknown')
+                    logger.info("  - Doc: %s, Score: %.4f", source, doc['hybrid_score'])
             # --- End Added Logging ---
             
+            # Only an answer the LLM actually generated, with nothing specific
+            # to this user in it, may be served to other askers from a cache
+            cacheable = False
+            user_profile = None
+            
             # Build system prompt with context
             if self.system_prompt_builder:
                 # Get user profile for personalization
                 user_profile = self.conversation_memory.get_user_profile(session_id or "default")
                 system_prompt = self.system_prompt_builder.build_system_prompt(retrieved_docs, user_profile)
                 # --- Added Logging for system prompt ---
-                logger.info(f"System Prompt created with {len(system_prompt)} characters.")
+                logger.info("System Prompt created with %s characters.", len(system_prompt))
                 # logger.debug(f"SYSTEM PROMPT: {system_prompt}") # DEBUG level for full prompt
                 # --- End Added Logging ---
             else:
@@ -693,55 +1015,45 @@ class RAGService:
             # Check cache first before processing
             cached_answer = self.response_cache.get(query_to_use) if hasattr(self, 'response_cache') else None
             if cached_answer:
-                logger.info(f"Cache HIT for query: '{query_to_use}'")
+                logger.info("Cache HIT for query: '%s'", query_to_use)
                 answer = cached_answer
             else:
                 answer = ""
                 if self.query_expander and self.query_expander.llm:
                      try:
                         logger.info("Generating answer with LLM...")
-                        # Add timeout to prevent hanging
+                        # Add timeout to prevent hanging. Tokens are passed on as
+                        # they arrive so callers can start showing the answer
                         try:
-                            response = await asyncio.wait_for(
-                                asyncio.to_thread(
-                                    self.query_expander.llm.chat.completions.create,
-                                    messages=[
-                                        {"role": "system", "content": system_prompt},
-                                        {"role": "user", "content": query_to_use}
-                                    ],
-                                    model="llama-3.1-8b-instant",
-                                    temperature=0.0,
-                                    max_tokens=500,
-                                    frequency_penalty=1.0, # Prevent repetition loops
-                                    presence_penalty=0.5
-                                ),
-                                timeout=30.0  # 30 second timeout
-                            )
-                            answer = response.choices[0].message.content.strip()
-                            logger.info(f"LLM generated answer length: {len(answer)}")
+                            parts = []
+                            async for delta in self._stream_llm_answer(system_prompt, query_to_use, timeout=30.0):
+                                parts.append(delta)
+                                yield {"type": "token", "text": delta}
+                            answer = "".join(parts).strip()
+                            logger.info("LLM generated answer length: %s", len(answer))
+                            cacheable = bool(answer) and not user_profile
                         except asyncio.TimeoutError:
                             logger.error("GROQ API timeout after 30 seconds")
                             answer = "I'm experiencing delays connecting to the AI service. Please try again in a moment."
                         except Exception as api_error:
-                            logger.error(f"GROQ API error: {api_error}")
+                            logger.error("GROQ API error: %s", api_error)
                             raise  # Re-raise to be caught by outer exception handler
                         
                         # Cache the response for future queries
-                        # Cache the response for future queries
-                        if hasattr(self, 'response_cache'):
+                        if hasattr(self, 'response_cache') and cacheable:
                             cache_key = query_to_use
                             last_write_key = f"{cache_key}:last_write_time"
                             current_time = time.time()
                             last_write = self.response_cache.get(last_write_key)
                             
                             if last_write and (current_time - float(last_write)) < 1.0:
-                                logger.debug(f"Duplicate cache write suppressed for: {cache_key}")
+                                logger.debug("Duplicate cache write suppressed for: %s", cache_key)
                             else:
                                 self.response_cache.set(cache_key, answer)
                                 self.response_cache.set(last_write_key, str(current_time))
                         
                         # If this is a branch query, check if we should ask for user preferences
-                        if is_branch_query and ("available" in query_to_use.lower() or "branches" in query_to_use.lower()):
+                        if is_branch_query and ("available" in query_lower or "branches" in query_lower):
                             # Get user profile information
                             user_profile = self.conversation_memory.get_user_profile(session_id or "default")
                             user_rank = user_profile.get("wbjee_rank", "not provided")
@@ -751,28 +1063,27 @@ class RAGService:
                             if user_rank == "not provided" or user_interests == "not specified":
                                 additional_prompt = "\n\nFor personalized branch recommendations, could you please share your WBJEE rank and your interests (like programming, electronics, mechanics, etc.)?"
                                 answer += additional_prompt
+                                cacheable = False
                                 
                      except Exception as e:
                          # --- Added specific logging for LLM failure ---
-                         logger.error(f"CRITICAL: LLM generation failed: {e}", exc_info=True)
+                         logger.error("CRITICAL: LLM generation failed: %s", e, exc_info=True)
                          # --- End Added Logging ---
                          # Fallback to top document text if LLM fails
                          if retrieved_docs:
                              top_doc = retrieved_docs[0]['document']
                              content = top_doc.get('text', '')
                              # Extract relevant information about HODs or fees based on query
-                             if 'hod' in query_to_use.lower() or 'head' in query_to_use.lower():
+                             if 'hod' in query_lower or 'head' in query_lower:
                                  # Look for HOD information in the content
-                                 import re
-                                 hod_match = re.search(r'(HOD|Head.*?)([A-Z][a-z]+\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)', content)
+                                 hod_match = _RE_HOD.search(content)
                                  if hod_match:
                                      answer = f"The HOD is {hod_match.group(2).strip()}"
                                  else:
                                      answer = f"Based on the available information: {content[:500]}"
-                             elif 'fee' in query_to_use.lower() or 'cost' in query_to_use.lower():
+                             elif 'fee' in query_lower or 'cost' in query_lower:
                                  # Look for fee information in the content
-                                 import re
-                                 fee_match = re.search(r'(fee|cost|tuition|\₹\d+,?\d*)\s*(?:per semester|per year|total)?\s*(\₹\d+,?\d*|\d+,?\d+)', content, re.IGNORECASE)
+                                 fee_match = _RE_FEE.search(content)
                                  if fee_match:
                                      answer = f"The fee information is: {fee_match.group(0)[:100]}"
                                  else:
@@ -786,16 +1097,14 @@ class RAGService:
                      top_doc = retrieved_docs[0]['document']
                      content = top_doc.get('text', '')
                      # Extract relevant information about HODs or fees based on query
-                     if 'hod' in query_to_use.lower() or 'head' in query_to_use.lower():
-                         import re
-                         hod_match = re.search(r'(HOD|Head.*?)([A-Z][a-z]+\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)', content)
+                     if 'hod' in query_lower or 'head' in query_lower:
+                         hod_match = _RE_HOD.search(content)
                          if hod_match:
                              answer = f"The HOD is {hod_match.group(2).strip()}"
                          else:
                              answer = f"Based on the available information: {content[:500]}"
-                     elif 'fee' in query_to_use.lower() or 'cost' in query_to_use.lower():
-                         import re
-                         fee_match = re.search(r'(fee|cost|tuition|\₹\d+,?\d*)\s*(?:per semester|per year|total)?\s*(\₹\d+,?\d*|\d+,?\d+)', content, re.IGNORECASE)
+                     elif 'fee' in query_lower or 'cost' in query_lower:
+                         fee_match = _RE_FEE.search(content)
                          if fee_match:
                              answer = f"The fee information is: {fee_match.group(0)[:100]}"
                          else:
@@ -818,14 +1127,13 @@ class RAGService:
             
             # Add user preferences to conversation memory if they provided rank or interests
             if session_id:
-                if "wbjee" in message.lower() or "rank" in message.lower():
+                if "wbjee" in message_lower or "rank" in message_lower:
                     # Extract rank from the message
-                    import re
-                    rank_match = re.search(r'(\d+)', message)
+                    rank_match = _RE_RANK.search(message)
                     if rank_match:
                         rank = rank_match.group(1)
                         self.conversation_memory.update_user_profile(session_id, "wbjee_rank", rank)
-                if any(interest in message.lower() for interest in ["programming", "coding", "software", "electronics", "mechanics", "civil", "electrical", "ai", "machine learning"]):
+                if any(interest in message_lower for interest in ["programming", "coding", "software", "electronics", "mechanics", "civil", "electrical", "ai", "machine learning"]):
                     self.conversation_memory.update_user_profile(session_id, "interests", message)
                 
                 # Add the interaction to conversation memory
@@ -837,11 +1145,12 @@ class RAGService:
                 "answer": answer,
                 "documents": retrieved_docs,
                 "query_used": query_to_use,
-                "processing_time": latency
+                "processing_time": latency,
+                "cacheable": cacheable
             }
         
         except Exception as e:
-            logger.error(f"Error in query_stream: {e}")
+            logger.error("Error in query_stream: %s", e)
             yield {
                 "type": "error",
                 "message": str(e)
@@ -891,12 +1200,28 @@ class RAGService:
                 self.response_cache.set(query, full_answer)
                 
         except Exception as e:
-            logger.error(f"Error in streaming answer generation: {e}")
+            logger.error("Error in streaming answer generation: %s", e)
             yield {
                 "type": "error",
                 "message": str(e)
             }
     
+    def end_session(self, session_id: str) -> None:
+        """
+        Release everything held for a session once its connection closes.
+        Per-session state is keyed by session id, so this is a few O(1) pops.
+        """
+        if self.query_expander is not None:
+            self.query_expander.forget_session(session_id)
+        self.conversation_memory.delete_session(session_id)
+    
+    def add_documents(self, documents: List[Dict]) -> None:
+        """Index newly uploaded chunks into the live retriever (CPU-bound: run off the event loop)."""
+        self.hybrid_retriever.add_documents(documents)
+        self.documents = self.hybrid_retriever.documents
+        # Cached answers may have been built from the replaced chunks
+        self.response_cache.clear()
+    
     def get_document_count(self):
         """Get total number of indexed documents"""
         return len(self.documents)
@@ -913,7 +1238,7 @@ class RAGService:
                 )
                 return True
             except Exception as e:
-                logger.error(f"Groq connection test failed: {e}")
+                logger.error("Groq connection test failed: %s", e)
                 return False
         return False
 
@@ -923,6 +1248,9 @@ class QueryPrefetcher:
     """
     def __init__(self, rag_service):
         self.rag_service = rag_service
+        # Strong references to running prefetches: the event loop only keeps
+        # weak ones, so an untracked task can be garbage-collected mid-flight
+        self._tasks: set = set()
         self.follow_up_patterns = {
             "admission": ["deadline", "fees", "documents", "eligibility"],
             "hostel": ["fees", "facilities", "rooms", "mess"],
@@ -932,34 +1260,47 @@ class QueryPrefetcher:
             "courses": ["syllabus", "credits", "duration", "fees"]
         }
     
+    def schedule(self, query: str) -> None:
+        """
+        Start prefetch_related in the background and keep track of the task.
+        """
+        task = asyncio.create_task(self.prefetch_related(query))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+    
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Prefetch task failed: %s", task.exception())
+    
     async def prefetch_related(self, query: str):
         """
         Prefetch related queries in background
         """
-        import asyncio
-        
         # Identify topic from query
         query_lower = query.lower()
         for topic, related in self.follow_up_patterns.items():
             if topic in query_lower:
-                # Prefetch related queries in background
-                for rel_query in related:
-                    # Create a background task to prefetch
-                    full_query = f"{topic} {rel_query}"
-                    asyncio.create_task(self._prefetch_query(full_query))
+                # Prefetch the related queries together; the group waits for all
+                # of them and cancels the rest if this task is cancelled
+                async with asyncio.TaskGroup() as tg:
+                    for rel_query in related:
+                        full_query = f"{topic} {rel_query}"
+                        tg.create_task(self._prefetch_query(full_query))
     
     async def _prefetch_query(self, query: str):
         """
         Internal method to prefetch a single query
         """
         try:
-            # Retrieve documents for the query to warm up cache
-            retrieved_docs = self.rag_service.hybrid_retriever.retrieve(query, k=3)
+            # Retrieve documents for the query to warm up cache. Retrieval is
+            # CPU-bound, so keep it off the event loop
+            retrieved_docs = await asyncio.to_thread(self.rag_service.hybrid_retriever.retrieve, query, 3)
             # Cache the retrieval results
             if hasattr(self.rag_service, 'response_cache'):
                 # We could cache the documents or even pre-generate responses
                 pass
         except Exception as e:
-            logger.error(f"Error in prefetching {query}: {e}")
+            logger.error("Error in prefetching %s: %s", query, e)
 
 # The duplicate class definition has been removed to fix the issue
\ No newline at end of file
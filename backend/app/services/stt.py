@@ -2,7 +2,7 @@ import asyncio
 import base64
 import io
 import logging
-from typing import Optional
+from typing import Optional, Union
 import speech_recognition as sr
 from pydub import AudioSegment
 
@@ -17,14 +17,17 @@ class STTService:
         self.base_url = "https://asr.api.speechmatics.com/v2"
         self.recognizer = sr.Recognizer()
     
-    async def transcribe_audio(self, audio_data: str) -> str:
+    async def transcribe_audio(self, audio_data: Union[str, bytes]) -> str:
         """
         Transcribe audio using Google Speech Recognition (Free tier)
-        audio_data: base64 encoded audio string
+        audio_data: raw audio bytes, or a base64 encoded audio string
         """
         try:
-            # Decode base64 audio data
-            audio_bytes = base64.b64decode(audio_data)
+            # Raw bytes arrive as-is from binary frames; strings are base64
+            if isinstance(audio_data, (bytes, bytearray)):
+                audio_bytes = bytes(audio_data)
+            else:
+                audio_bytes = base64.b64decode(audio_data)
             
             # Convert audio bytes to compatible format (WAV) using pydub if needed
             # Assuming input is likely webm/wav from browser
@@ -37,7 +40,7 @@ class STTService:
                 wav_io.seek(0)
             except Exception as e:
                 # If conversion fails, try direct WAV read
-                logger.warning(f"Audio conversion failed, trying raw bytes: {e}")
+                logger.warning("Audio conversion failed, trying raw bytes: %s", e)
                 wav_io = io.BytesIO(audio_bytes)
 
             # Use SpeechRecognition
@@ -52,17 +55,17 @@ class STTService:
                 lambda: self.recognizer.recognize_google(audio_content)
             )
             
-            logger.info(f"Successfully transcribed audio: {text[:50]}...")
+            logger.info("Successfully transcribed audio: %.50s...", text)
             return text
 
         except sr.UnknownValueError:
             logger.info("Speech Recognition could not understand audio")
             return ""
         except sr.RequestError as e:
-            logger.error(f"Could not request results from Google Speech Recognition service; {e}")
+            logger.error("Could not request results from Google Speech Recognition service; %s", e)
             raise Exception(f"STT Error: {e}")
         except Exception as e:
-            logger.error(f"Error in transcribe_audio: {e}")
+            logger.error("Error in transcribe_audio: %s", e)
             # If ffmpeg is missing for pydub, this might fail.
             # Fallback message?
             return ""
@@ -4,7 +4,7 @@ import re
 import os
 import tempfile
 import asyncio
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 from gtts import gTTS
 import pyttsx3
@@ -15,6 +15,45 @@ class TTSAPIError(Exception):
 
 logger = logging.getLogger(__name__)
 
+# pyttsx3 synthesizes on local CPU (and its engine isn't safe to drive from two
+# threads), so fallback renders queue here instead of contending for cores.
+# gTTS is a network call and stays concurrent
+_local_tts_semaphore = asyncio.Semaphore(1)
+
+# Compiled once: these run over every answer that is spoken
+_MARKDOWN_PATTERNS = [
+    (re.compile(r'\*\*([^\*]+)\*\*'), r'\1'),
+    (re.compile(r'\*([^\*]+)\*'), r'\1'),
+    (re.compile(r'__([^_]+)__'), r'\1'),
+    (re.compile(r'_([^_]+)_'), r'\1'),
+    (re.compile(r'^[\s]*[•\-\*]\s+', re.MULTILINE), ''),
+    (re.compile(r'^#+\s+', re.MULTILINE), ''),
+    (re.compile(r'\[([^\]]+)\]\([^\)]+\)'), r'\1'),
+    (re.compile(r'`([^`]+)`'), r'\1'),
+]
+
+# Spoken forms, keyed by the upper-cased acronym as written
+_ACRONYMS = {
+    'IT': 'I T',
+    'CSE': 'C S E',
+    'AIML': 'A I M L',
+    'ECE': 'E C E',
+    'EE': 'E E',
+    'ME': 'M E',
+    'CE': 'C E',
+    'CS': 'C S',
+    'DS': 'D S',
+    'CSD': 'C S D',
+    'BTECH': 'B Tech',
+    'B.TECH': 'B Tech',
+    'MTECH': 'M Tech',
+    'M.TECH': 'M Tech',
+}
+_ACRONYM_RE = re.compile(
+    r'\b(?:' + '|'.join(re.escape(a) for a in sorted(_ACRONYMS, key=len, reverse=True)) + r')\b',
+    re.IGNORECASE
+)
+
 class TTSService:
     def __init__(self):
         """Initialize TTS service"""
@@ -35,43 +74,42 @@ class TTSService:
         try:
             return await self._generate_gtts(processed_text)
         except Exception as e:
-            logger.warning(f"gTTS failed ({e}), attempting fallback to pyttsx3...")
+            logger.warning("gTTS failed (%s), attempting fallback to pyttsx3...", e)
             return await self._generate_pyttsx3(processed_text)
 
+    async def text_to_speech_stream(self, text: str) -> AsyncIterator[bytes]:
+        """
+        Like text_to_speech, but yields audio chunks as gTTS produces them
+        (one per text segment) so callers can write them out without holding
+        the whole clip in memory. Falls back to pyttsx3 only if gTTS fails
+        before producing any audio.
+        """
+        processed_text = self._expand_acronyms(self._strip_markdown(text))
+        
+        started = False
+        try:
+            tts = gTTS(text=processed_text, lang='en', tld='co.in', slow=False)
+            chunks = tts.stream()
+            while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                started = True
+                yield chunk
+        except Exception as e:
+            if started:
+                raise
+            logger.warning("gTTS failed (%s), attempting fallback to pyttsx3...", e)
+            yield await self._generate_pyttsx3(processed_text)
+
     def _strip_markdown(self, text: str) -> str:
         """Remove markdown formatting"""
-        text = re.sub(r'\*\*([^\*]+)\*\*', r'\1', text)
-        text = re.sub(r'\*([^\*]+)\*', r'\1', text)
-        text = re.sub(r'__([^_]+)__', r'\1', text)
-        text = re.sub(r'_([^_]+)_', r'\1', text)
-        text = re.sub(r'^[\s]*[•\-\*]\s+', '', text, flags=re.MULTILINE)
-        text = re.sub(r'^#+\s+', '', text, flags=re.MULTILINE)
-        text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
-        text = re.sub(r'`([^`]+)`', r'\1', text)
+        for pattern, replacement in _MARKDOWN_PATTERNS:
+            text = pattern.sub(replacement, text)
         return text.strip()
     
     def _expand_acronyms(self, text: str) -> str:
         """Expand acronyms"""
         processed_text = text.replace('₹', 'rupees ')
-        acronyms = {
-            r'\bIT\b': 'I T',
-            r'\bCSE\b': 'C S E',
-            r'\bAIML\b': 'A I M L',
-            r'\bECE\b': 'E C E',
-            r'\bEE\b': 'E E',
-            r'\bME\b': 'M E',
-            r'\bCE\b': 'C E',
-            r'\bCS\b': 'C S',
-            r'\bDS\b': 'D S',
-            r'\bCSD\b': 'C S D',
-            r'\bBTech\b': 'B Tech',
-            r'\bB\.Tech\b': 'B Tech',
-            r'\bMTech\b': 'M Tech',
-            r'\bM\.Tech\b': 'M Tech'
-        }
-        for pattern, replacement in acronyms.items():
-            processed_text = re.sub(pattern, replacement, processed_text, flags=re.IGNORECASE)
-        return processed_text
+        # One scan over the text for all acronyms instead of one re.sub per acronym
+        return _ACRONYM_RE.sub(lambda m: _ACRONYMS[m.group(0).upper()], processed_text)
 
     async def _generate_gtts(self, text: str) -> bytes:
         """Generate using Google Text-to-Speech"""
@@ -85,7 +123,11 @@ class TTSService:
         return await asyncio.to_thread(_run)
 
     async def _generate_pyttsx3(self, text: str) -> bytes:
-        """Generate using local pyttsx3"""
+        """Generate using local pyttsx3, one render at a time"""
+        async with _local_tts_semaphore:
+            return await self._generate_pyttsx3_unlocked(text)
+
+    async def _generate_pyttsx3_unlocked(self, text: str) -> bytes:
         def _run():
             engine = pyttsx3.init()
             engine.setProperty('rate', 150)
@@ -3,8 +3,9 @@ import os
 import logging
 import json
 import pickle
+import threading
 import numpy as np
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Set, Tuple
 from pathlib import Path
 
 # Try to import FAISS and SentenceTransformer
@@ -17,6 +18,13 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Quantized candidates reranked in float32 per search (indexes built by add_documents)
+RERANK_CANDIDATES = 32
+# Vectors needed before the int8 quantizer is trained; smaller stores are searched exactly
+MIN_QUANTIZE_TRAINING = 256
+# Retrain the quantizer once the store is this many times its training set
+RETRAIN_GROWTH = 4
+
 class VectorStore:
     """
     Abstract base class for vector storage (to allow easy swapping in future)
@@ -46,6 +54,9 @@ class FAISSVectorStore(VectorStore):
         
         self.documents = []  # Stores the actual document metadata/content
         self.index = None    # FAISS index
+        self._trained_on = 0 # Vectors the quantizer was trained on (0 while exact)
+        # Keeps searches from seeing the index and document list mid-swap
+        self._lock = threading.Lock()
         
         if not HAS_FAISS:
              logger.warning("FAISS or SentenceTransformers not installed. Vector search will be disabled.")
@@ -53,10 +64,10 @@ class FAISSVectorStore(VectorStore):
              return
 
         try:
-            logger.info(f"Loading embedding model: {model_name}")
+            logger.info("Loading embedding model: %s", model_name)
             self.model = SentenceTransformer(model_name)
         except Exception as e:
-            logger.error(f"Failed to load embedding model: {e}")
+            logger.error("Failed to load embedding model: %s", e)
             self.model = None
             
         # Try to load existing index
@@ -67,7 +78,7 @@ class FAISSVectorStore(VectorStore):
             current_dim = self.model.get_sentence_embedding_dimension()
             index_dim = self.index.d
             if current_dim != index_dim:
-                logger.warning(f"Dimension mismatch! Index: {index_dim}, Model: {current_dim}. Resetting vector store.")
+                logger.warning("Dimension mismatch! Index: %s, Model: %s. Resetting vector store.", index_dim, current_dim)
                 self.index = None
                 self.documents = []
                 # Clear files to prevent reload on next restart
@@ -89,25 +100,116 @@ class FAISSVectorStore(VectorStore):
         texts = [doc.get('text', '') for doc in documents]
         
         # Generate embeddings
-        logger.info(f"Generating embeddings for {len(texts)} documents...")
+        logger.info("Generating embeddings for %s documents...", len(texts))
         embeddings = self.model.encode(texts)
         
-        # Initialize index if needed
-        if self.index is None:
-            dimension = embeddings.shape[1]
-            # using IndexFlatL2 for exact search (good for small datasets < 1M)
-            self.index = faiss.IndexFlatL2(dimension)
-            
-        # Add to FAISS index
-        self.index.add(np.array(embeddings).astype('float32'))
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
         
-        # Store document data
-        # We append to existing documents because FAISS adds sequentially
-        self.documents.extend(documents)
+        stored = self.index.ntotal if self.index is not None else 0
+        if self._needs_rebuild(stored + len(vectors)):
+            # The quantizer learns per-dimension ranges, so (re)train it on
+            # every stored vector rather than on whichever batch came first
+            if stored:
+                vectors = np.vstack([self.index.reconstruct_n(0, stored), vectors])
+            index, trained_on = self._build_index(vectors)
+            with self._lock:
+                self.index, self._trained_on = index, trained_on
+                self.documents = self.documents + documents
+        else:
+            with self._lock:
+                # Add to FAISS index
+                self.index.add(vectors)
+                
+                # Store document data
+                # We append to existing documents because FAISS adds sequentially
+                self.documents = self.documents + documents
         
-        logger.info(f"Added {len(documents)} documents to vector store. Total: {len(self.documents)}")
+        logger.info("Added %s documents to vector store. Total: %s", len(documents), len(self.documents))
         self.save()
 
+    def remove_sources(self, sources: Set[str]) -> int:
+        """
+        Drop every chunk from the given sources and its vector.
+        The quantized index can't remove ids, so the index is rebuilt from
+        the stored vectors of the chunks that are kept (nothing is re-embedded).
+        Returns the number of chunks removed.
+        """
+        if self.index is None:
+            return 0
+        keep = [i for i, doc in enumerate(self.documents) if doc.get('source') not in sources]
+        removed = len(self.documents) - len(keep)
+        if not removed:
+            return 0
+        
+        documents = [self.documents[i] for i in keep]
+        index, trained_on = None, 0
+        if keep:
+            vectors = np.ascontiguousarray(self.index.reconstruct_n(0, self.index.ntotal)[keep])
+            index, trained_on = self._build_index(vectors)
+        
+        with self._lock:
+            self.index, self._trained_on = index, trained_on
+            self.documents = documents
+        
+        logger.info("Removed %s documents from vector store. Total: %s", removed, len(documents))
+        if index is None:
+            # save() skips an empty store, so drop the files it would reload
+            if self.index_file.exists(): os.remove(self.index_file)
+            if self.docs_file.exists(): os.remove(self.docs_file)
+        else:
+            self.save()
+        return removed
+
+    def _needs_rebuild(self, total: int) -> bool:
+        """Whether an index holding `total` vectors should be rebuilt first."""
+        if self.index is None:
+            return True
+        if not self._trained_on:
+            return total >= MIN_QUANTIZE_TRAINING
+        return total >= RETRAIN_GROWTH * self._trained_on
+
+    @staticmethod
+    def _build_index(vectors: np.ndarray):
+        """
+        Index `vectors`, returning (index, vectors the quantizer was trained on).
+        Below MIN_QUANTIZE_TRAINING the int8 ranges can't be estimated reliably,
+        so small stores use an exact IndexFlatL2.
+        """
+        dimension = vectors.shape[1]
+        if len(vectors) < MIN_QUANTIZE_TRAINING:
+            index, trained_on = faiss.IndexFlatL2(dimension), 0
+        else:
+            # Scan int8-quantized vectors (4x less memory bandwidth than float32),
+            # then rerank the best candidates exactly against the float32 copies
+            index = faiss.IndexRefineFlat(
+                faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+            )
+            index.train(vectors)
+            trained_on = len(vectors)
+        index.add(vectors)
+        return index, trained_on
+
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """
+        Embed a single query as an L2-normalized float32 vector.
+        Returns None when no embedding model is available.
+        """
+        if not self.model:
+            return None
+        vector = np.asarray(self.model.encode([query])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def warmup(self) -> None:
+        """
+        Run one throwaway encode and search so the first real query doesn't pay
+        for the model's lazy initialization or for paging in the index.
+        """
+        if not self.model:
+            return
+        self.model.encode(["warmup"])
+        self.search("warmup", k=1)
+
     def search(self, query: str, k: int = 5) -> List[Tuple[Dict[str, Any], float]]:
         """
         Search for similar documents.
@@ -120,14 +222,20 @@ class FAISSVectorStore(VectorStore):
         
         # Search FAISS
         # D: distances (lower is better for L2), I: indices
-        D, I = self.index.search(np.array(query_vector).astype('float32'), k)
+        with self._lock:
+            index, documents = self.index, self.documents
+            if index is None:
+                return []
+            if isinstance(index, faiss.IndexRefine):
+                index.k_factor = max(1.0, RERANK_CANDIDATES / k)
+            D, I = index.search(np.array(query_vector).astype('float32'), k)
         
         results = []
         for j, doc_idx in enumerate(I[0]):
-            if doc_idx < 0 or doc_idx >= len(self.documents):
+            if doc_idx < 0 or doc_idx >= len(documents):
                 continue
                 
-            doc = self.documents[doc_idx]
+            doc = documents[doc_idx]
             score = float(D[0][j])
             
             # FAISS L2 distance: 0 is identical.
@@ -146,22 +254,34 @@ class FAISSVectorStore(VectorStore):
             
         if self.index:
             try:
-                faiss.write_index(self.index, str(self.index_file))
-                with open(self.docs_file, 'wb') as f:
+                # Write to temp files and publish with os.replace so a reader
+                # never sees a half-written index or document list
+                index_tmp = self.index_file.with_suffix(".bin.tmp")
+                docs_tmp = self.docs_file.with_suffix(".pkl.tmp")
+                faiss.write_index(self.index, str(index_tmp))
+                with open(docs_tmp, 'wb') as f:
                     pickle.dump(self.documents, f)
-                logger.info(f"Saved vector store to {self.persist_dir}")
+                os.replace(index_tmp, self.index_file)
+                os.replace(docs_tmp, self.docs_file)
+                logger.info("Saved vector store to %s", self.persist_dir)
             except Exception as e:
-                logger.error(f"Error saving vector store: {e}")
+                logger.error("Error saving vector store: %s", e)
 
     def load(self) -> None:
         """Load index and documents from disk"""
         if self.index_file.exists() and self.docs_file.exists():
             try:
-                self.index = faiss.read_index(str(self.index_file))
+                index = faiss.read_index(str(self.index_file))
                 with open(self.docs_file, 'rb') as f:
                     self.documents = pickle.load(f)
-                logger.info(f"Loaded vector store with {len(self.documents)} documents")
+                # The saved quantizer's training size isn't recorded (and older
+                # indexes were trained on their first batch), so retrain it on
+                # everything stored
+                if index.ntotal:
+                    index, self._trained_on = self._build_index(index.reconstruct_n(0, index.ntotal))
+                self.index = index
+                logger.info("Loaded vector store with %s documents", len(self.documents))
             except Exception as e:
-                logger.error(f"Error loading vector store: {e}")
+                logger.error("Error loading vector store: %s", e)
                 self.index = None
                 self.documents = []
@@ -3,8 +3,8 @@ import asyncio
 import logging
 from app.services.document_processor import DocumentProcessor
 from app.services.rag import RAGService
+from app.services.document_store import DocumentStore
 from pathlib import Path
-import json
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,10 +31,8 @@ async def main():
         documents = await doc_processor.process_files_batch(files)
         print(f"✅ Processed into {len(documents)} chunks.")
 
-        # Save documents to JSON (as RAGService expects)
-        Path("chroma_db").mkdir(exist_ok=True)
-        with open("chroma_db/documents.json", "w", encoding="utf-8") as f:
-            json.dump(documents, f, indent=2)
+        # Save documents snapshot (as RAGService expects)
+        DocumentStore("chroma_db").write_snapshot(documents)
             
         # Index documents
         print("Indexing documents into FAISS/BM25...")
@@ -1,8 +1,9 @@
 import os
 import sys
 import asyncio
+from typing import List
 from app.services.document_processor import DocumentProcessor
-from app.services.rag import RAGService
+from app.services.document_store import DocumentStore
 from app.config import settings
 
 # Setup basic logging
@@ -10,37 +11,50 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Files parsed at once
+PROCESS_CONCURRENCY = min(8, os.cpu_count() or 1)
+
+def _scan_uploads(upload_dir: str) -> List[str]:
+    """Paths of regular files in upload_dir (scandir: no extra stat per entry)."""
+    with os.scandir(upload_dir) as it:
+        return sorted(entry.path for entry in it if entry.is_file())
+
 async def reindex_documents():
     """Re-process all files in the uploads directory."""
-    
+
     upload_dir = settings.upload_dir
-    if not os.path.exists(upload_dir):
-        logger.error(f"Upload directory not found: {upload_dir}")
+    logger.info("Starting re-indexing from: %s", upload_dir)
+
+    try:
+        files = await asyncio.to_thread(_scan_uploads, upload_dir)
+    except FileNotFoundError:
+        logger.error("Upload directory not found: %s", upload_dir)
         return
 
-    logger.info(f"Starting re-indexing from: {upload_dir}")
-    
     processor = DocumentProcessor()
-    rag = RAGService()
-    
-    # Clear existing documents
-    rag.documents = []
-    
-    files = [f for f in os.listdir(upload_dir) if os.path.isfile(os.path.join(upload_dir, f))]
-    
-    for filename in files:
-        file_path = os.path.join(upload_dir, filename)
-        logger.info(f"Processing: {filename}")
-        
-        try:
-            chunks = processor.process_file(file_path)
-            rag.add_documents(chunks)
-            logger.info(f"  -> Added {len(chunks)} chunks")
-        except Exception as e:
-            logger.error(f"  -> Failed to process {filename}: {e}")
-            
+    sem = asyncio.Semaphore(PROCESS_CONCURRENCY)
+
+    async def _process_one(file_path: str):
+        async with sem:
+            logger.info("Processing: %s", os.path.basename(file_path))
+            return await processor.process_file(file_path)
+
+    results = await asyncio.gather(*[_process_one(f) for f in files], return_exceptions=True)
+
+    documents = []
+    for file_path, result in zip(files, results):
+        filename = os.path.basename(file_path)
+        if isinstance(result, Exception):
+            logger.error("  -> Failed to process %s: %s", filename, result)
+            continue
+        documents.extend(result)
+        logger.info("  -> %s: %s chunks", filename, len(result))
+
+    # Replace the stored documents in one write instead of once per file
+    DocumentStore(settings.chroma_persist_dir).write_snapshot(documents)
+
     logger.info("Re-indexing complete!")
-    logger.info(f"Total documents in DB: {len(rag.documents)}")
+    logger.info("Total documents in DB: %s", len(documents))
 
 if __name__ == "__main__":
     # Add backend to path so imports work
@@ -47,6 +47,8 @@ const VoiceChat: React.FC = () => {
 
     const voice = useVoice({ language: 'en-US' });
     const utteranceRef = useRef<SpeechSynthesisUtterance | null>(null);
+    // Rendered speech announced by the voice WebSocket, keyed by answer text
+    const audioUrlsRef = useRef<Map<string, string>>(new Map());
     const micStreamRef = useRef<MediaStream | null>(null);
     const vadCtxRef = useRef<AudioContext | null>(null);
     const vadAnalyserRef = useRef<AnalyserNode | null>(null);
@@ -99,11 +101,25 @@ const VoiceChat: React.FC = () => {
         try {
             setIsSpeaking(true);
 
-            // Call Backend TTS endpoint
+            // Already rendered: stream the file straight from the /audio mount
+            const renderedUrl = audioUrlsRef.current.get(text);
+            if (renderedUrl) {
+                const audio = new Audio(`${API_BASE}${renderedUrl}`);
+                audio.onended = () => setIsSpeaking(false);
+                audio.onerror = (e) => {
+                    console.error("Audio playback error:", e);
+                    setIsSpeaking(false);
+                };
+                await audio.play();
+                return;
+            }
+
+            // Call Backend TTS endpoint (audio comes back in the same response)
             const res = await fetch(`${API_BASE}/qa/tts`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'audio/mpeg',
                 },
                 body: JSON.stringify({
                     text: text,
@@ -112,14 +128,18 @@ const VoiceChat: React.FC = () => {
             });
 
             if (res.ok) {
-                const data = await res.json();
-                const audioUrl = `${API_BASE}${data.audio_url}`;
+                const blob = await res.blob();
+                const audioUrl = URL.createObjectURL(blob);
 
                 // Play audio
                 const audio = new Audio(audioUrl);
-                audio.onended = () => setIsSpeaking(false);
+                audio.onended = () => {
+                    URL.revokeObjectURL(audioUrl);
+                    setIsSpeaking(false);
+                };
                 audio.onerror = (e) => {
                     console.error("Audio playback error:", e);
+                    URL.revokeObjectURL(audioUrl);
                     setIsSpeaking(false);
                 };
                 await audio.play();
@@ -237,8 +257,13 @@ const VoiceChat: React.FC = () => {
                         setAnswer(data.text);
                     } else if (data.type === 'answer_chunk') {
                         setAnswer(prev => prev ? prev + data.text : data.text);
+                    } else if (data.type === 'audio') {
+                        audioUrlsRef.current.set(data.text, data.audio_url);
                     } else if (data.type === 'answer') {
                         setAnswer(data.text);
+                        if (data.audio_url) {
+                            audioUrlsRef.current.set(data.text, data.audio_url);
+                        }
                         if (data.session_id) {
                             setSessionId(data.session_id);
                         }
@@ -1,7 +1,6 @@
 import asyncio
 import os
 import sys
-import json
 import shutil
 from pathlib import Path
 
@@ -10,6 +9,7 @@ sys.path.append(os.path.join(os.getcwd(), 'backend'))
 
 from app.services.document_processor import DocumentProcessor
 from app.services.vector_store import FAISSVectorStore
+from app.services.document_store import DocumentStore
 from app.config import settings
 
 # Configure logging
@@ -54,11 +54,9 @@ async def rebuild():
             print(f"Error processing {filename}: {e}")
             traceback.print_exc()
             
-    # 3. Save documents.json
-    doc_file = chroma_dir / "documents.json"
-    with open(doc_file, 'w', encoding='utf-8') as f:
-        json.dump(all_docs, f, ensure_ascii=False, indent=2)
-    print(f"Saved {len(all_docs)} chunks to {doc_file}")
+    # 3. Save documents.json (truncating the append log so it isn't replayed over the rebuild)
+    DocumentStore(str(chroma_dir)).write_snapshot(all_docs)
+    print(f"Saved {len(all_docs)} chunks to {chroma_dir / 'documents.json'}")
     
     # 4. Generate Embeddings (Vector Store)
     print("Generating embeddings (this may take a while)...")